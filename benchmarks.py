@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks
+
+Micro-benchmarks for the hot paths of the document converter. Each benchmark
+prints its timings so that changes can be compared before and after.
+
+Usage:
+    python benchmarks.py [entries] [index] [tables]
+"""
+
+import argparse
+import gc
+import os
+import time
+
+from docx import Document
+
+import document_converter
+
+
+def time_call(func, *args, **kwargs):
+    """
+    Run a function once and measure its wall-clock time.
+
+    Garbage left by earlier runs is collected first, so that it is not
+    charged to this one.
+
+    Args:
+        func (callable): Function to run
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        float: Elapsed time in seconds
+    """
+    gc.collect()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def fill_table_per_cell(doc, rows):
+    """
+    Fill a table through python-docx cell access, as the processors used to.
+
+    Args:
+        doc (Document): Word document object
+        rows (list): List of rows, each a list of cell strings
+
+    Returns:
+        None
+    """
+    table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+    table.style = 'Table Grid'
+    for i, row in enumerate(rows):
+        for j, cell_value in enumerate(row):
+            table.cell(i, j).text = cell_value
+
+
+def bench_tables(sizes=(8, 16, 32, 64, 128, 256), per_cell_limit=32):
+    """
+    Compare the cost per cell of filling square tables of growing size.
+
+    The per-cell python-docx path grows with the table size, while the bulk
+    builder used by the report writers stays flat (linear total cost).
+
+    Args:
+        sizes (tuple, optional): Table side lengths to measure
+        per_cell_limit (int, optional): Largest side length measured with the
+            per-cell path, which gets too slow beyond it
+
+    Returns:
+        None
+    """
+    print(f"{'cells':>8} {'per-cell (us/cell)':>20} {'bulk (us/cell)':>16}")
+    for size in sizes:
+        rows = [[f"r{i}c{j}" for j in range(size)] for i in range(size)]
+        cells = size * size
+        if size <= per_cell_limit:
+            per_cell = f"{time_call(fill_table_per_cell, Document(), rows) / cells * 1e6:.1f}"
+        else:
+            per_cell = "-"
+        bulk = time_call(document_converter.DocxReportWriter().add_table, rows)
+        print(f"{cells:>8} {per_cell:>20} {bulk / cells * 1e6:>16.1f}")
+
+
+def add_index_entries_python_docx(doc, count):
+    """
+    Add File Index entries through python-docx's add_paragraph.
+
+    Args:
+        doc (Document): Word document object
+        count (int): Number of entries to add
+
+    Returns:
+        None
+    """
+    for i in range(count):
+        document_converter.add_index_entry(doc.add_paragraph(), f"file{i}.pdf", f"bm_file{i}_pdf",
+                                           "a/b/c", "a/b/c")
+
+
+def add_index_entries_writer(report, count):
+    """
+    Add File Index entries through a report writer.
+
+    Args:
+        report (DocxReportWriter): Report writer
+        count (int): Number of entries to add
+
+    Returns:
+        None
+    """
+    for i in range(count):
+        report.add_index_entry(f"file{i}.pdf", f"bm_file{i}_pdf", "a/b/c", "a/b/c")
+
+
+def add_index_entries_bulk(report, count):
+    """
+    Add File Index entries through a report writer's bulk path.
+
+    Args:
+        report (DocxReportWriter): Report writer
+        count (int): Number of entries to add
+
+    Returns:
+        None
+    """
+    report.add_index_entries((f"file{i}.pdf", f"bm_file{i}_pdf", "a/b/c", "a/b/c") for i in range(count))
+
+
+def bench_index(counts=(10000, 25000, 50000, 100000), python_docx_limit=25000):
+    """
+    Compare the cost per entry of appending File Index entries to a report.
+
+    python-docx's add_paragraph scans the body for the section properties on
+    every call, so its cost per entry grows with the report; the report
+    writer's append path stays flat, and its bulk path serializes the
+    entries from a template instead of building their elements one by one.
+
+    Args:
+        counts (tuple, optional): Numbers of entries to build
+        python_docx_limit (int, optional): Largest count measured through
+            python-docx, which gets too slow beyond it
+
+    Returns:
+        None
+    """
+    print(f"{'entries':>8} {'python-docx (us/entry)':>24} {'writer (us/entry)':>19} {'bulk (us/entry)':>17} "
+          f"{'speedup':>8}")
+    for count in counts:
+        if count <= python_docx_limit:
+            elapsed = time_call(add_index_entries_python_docx, Document(), count)
+            python_docx = f"{elapsed / count * 1e6:.1f}"
+        else:
+            python_docx = "-"
+        writer = time_call(add_index_entries_writer, document_converter.DocxReportWriter(), count)
+        bulk = time_call(add_index_entries_bulk, document_converter.DocxReportWriter(), count)
+        print(f"{count:>8} {python_docx:>24} {writer / count * 1e6:>19.1f} {bulk / count * 1e6:>17.1f} "
+              f"{writer / bulk:>7.1f}x")
+
+
+def locate_with_path_helpers(input_dir, paths):
+    """
+    Derive the location strings of files with the path helpers, twice per
+    file as the processing loop and the File Index used to.
+
+    Args:
+        input_dir (str): Input directory
+        paths (list): File paths under input_dir
+
+    Returns:
+        None
+    """
+    for _ in range(2):
+        for file_path in paths:
+            document_converter.get_path_context(file_path, input_dir)
+            document_converter.get_relative_path(file_path, input_dir)
+
+
+def build_file_entries(input_dir, listing):
+    """
+    Build FileEntry records the way the scanner does, deriving the location
+    strings once per directory.
+
+    Args:
+        input_dir (str): Input directory
+        listing (list): (relative directory, file names) of each directory
+
+    Returns:
+        list: FileEntry of each file
+    """
+    entries = []
+    for rel_path, names in listing:
+        rel_dir, context = document_converter.get_dir_context(rel_path)
+        dir_path = os.path.join(input_dir, rel_path)
+        for name in names:
+            entries.append(document_converter.FileEntry(os.path.join(dir_path, name), name, rel_dir, context,
+                                                        1024, 0))
+    return entries
+
+
+def bench_entries(counts=(100000, 1000000), files_per_dir=100):
+    """
+    Compare the cost per file of the path helpers with FileEntry records.
+
+    Args:
+        counts (tuple, optional): Numbers of file paths
+        files_per_dir (int, optional): Files in each synthetic directory
+
+    Returns:
+        None
+    """
+    input_dir = os.path.abspath("input")
+    print(f"{'paths':>8} {'path helpers (us/path)':>24} {'entries (us/path)':>19}")
+    for count in counts:
+        listing = []
+        for i in range(count // files_per_dir):
+            rel_path = f"dept{i % 10}/project{i // 10 % 100}/batch{i}"
+            listing.append((rel_path, [f"file{j}.pdf" for j in range(files_per_dir)]))
+        paths = [os.path.join(input_dir, rel_path, name) for rel_path, names in listing for name in names]
+        helpers = time_call(locate_with_path_helpers, input_dir, paths)
+        entries = time_call(build_file_entries, input_dir, listing)
+        print(f"{count:>8} {helpers / count * 1e6:>24.2f} {entries / count * 1e6:>19.2f}")
+
+
+BENCHMARKS = {
+    'entries': bench_entries,
+    'index': bench_index,
+    'tables': bench_tables,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run document converter benchmarks")
+    parser.add_argument("benchmark", nargs="*",
+                        help=f"Benchmarks to run, any of {', '.join(sorted(BENCHMARKS))} (default: all)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmark if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    for name in args.benchmark or sorted(BENCHMARKS):
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
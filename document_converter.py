@@ -11,680 +11,4905 @@ Version: 1.0
 """
 
 import os
+import codecs
+import copy
+import csv
+import itertools
+import concurrent.futures
+import contextlib
+import multiprocessing.util
+import hashlib
+import heapq
+import json
+import mmap
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+import chardet
 import fitz  # PyMuPDF
 from docx import Document
-from docx.shared import Inches, Pt
-from PIL import Image
+from docx.enum.text import WD_BREAK
+from docx.image.image import Image as DocxImage
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.shared import Emu, Inches, Pt
+from docx.text.paragraph import Paragraph
+from lxml import etree
+from PIL import ExifTags, Image
 import openpyxl
-from io import BytesIO
+from openpyxl.utils import get_column_letter
+import io
+from io import BytesIO, StringIO
+from xml.sax.saxutils import escape
 import textwrap
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
 import fnmatch
-import win32com.client  # For updating TOC
 import docx.opc.constants  # For hyperlink functionality
-import pythoncom
+from docx.enum.style import WD_STYLE_TYPE
 
+try:
+    import win32com.client  # For Office conversions and updating fields
+    import pythoncom
+except ImportError:
+    # pywin32 is only available on Windows; Office features are skipped
+    win32com = None
+    pythoncom = None
 
-def process_pdf(file_path, doc):
+try:
+    import uno  # LibreOffice's Python bridge, for headless conversions
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    # Only available with LibreOffice's bundled or distribution Python bindings
+    uno = None
+    PropertyValue = None
+
+
+class RenderSettings:
     """
-    Process a PDF file and add its first page to the Word document.
+    Options controlling how file previews are rendered.
     
-    Args:
-        file_path (str): Path to the PDF file
-        doc (Document): Word document object
-        
-    Returns:
-        None
+    Settings are passed unchanged to every processor, including those running
+    in worker processes, so they must stay picklable.
     """
-    try:
-        pdf = fitz.open(file_path)
-        page = pdf[0]
-        zoom = 2  # zoom factor for better quality
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
-        img_path = f"temp_{os.path.basename(file_path)}.png"
-        pix.save(img_path)
-        # Add to Word doc
-        doc.add_picture(img_path, width=Inches(6))
-        os.remove(img_path)
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
+    
+    # Settings that do not change the rendered previews
+    NON_OUTPUT_SETTINGS = ('converter_recycle', 'excel_sheet_jobs')
+    
+    def __init__(self, image_format='png', jpeg_quality=85, zoom=2, converter='auto',
+                 converter_recycle=50, word_pages=1, excel_pages=1, tail_extensions=('.log',),
+                 csv_profile=False, csv_profile_rows=1000000, excel_sheets=1, excel_sheet_jobs=0,
+                 use_thumbnails=True, image_dpi=150, vector_pdf=False):
+        """
+        Args:
+            image_format (str, optional): Encoding for rendered pages, 'png' or
+                'jpeg'. Defaults to 'png'.
+            jpeg_quality (int, optional): JPEG quality (1-100) used when
+                image_format is 'jpeg'. Defaults to 85.
+            zoom (float, optional): Zoom factor applied when rasterizing PDF
+                pages. Defaults to 2.
+            converter (str, optional): Backend converting Word and Excel files
+                to PDF: a key of CONVERTER_BACKENDS, 'auto' for the first
+                available real converter or 'none'. Defaults to 'auto'.
+            converter_recycle (int, optional): Documents converted by a
+                converter instance before it is restarted, 0 to never restart.
+                Defaults to 50.
+            word_pages (int, optional): Leading pages of Word documents exported
+                to PDF for the preview, 0 to export the whole document.
+                Defaults to 1.
+            excel_pages (int, optional): Leading printed pages of Excel
+                workbooks exported to PDF, 0 for the whole workbook.
+                Defaults to 1.
+            tail_extensions (iterable, optional): Extensions of text files
+                previewed from their last lines instead of their first ones.
+                Defaults to ('.log',).
+            csv_profile (bool, optional): Add row and column statistics to
+                CSV previews. Defaults to False.
+            csv_profile_rows (int, optional): Data rows the CSV column
+                statistics are computed over, 0 for all of them. The row count
+                always covers the whole file. Defaults to 1000000.
+            excel_sheets (int, optional): Worksheets previewed per workbook, 0
+                for all of them. With 1, the active sheet is previewed as
+                before; otherwise the data of each sheet is shown under its
+                own subheading. Defaults to 1.
+            excel_sheet_jobs (int, optional): Worker processes reading the
+                sheets of a large workbook concurrently, 0 for the number of
+                CPU cores. Defaults to 0.
+            use_thumbnails (bool, optional): Preview Word and Excel files by
+                the thumbnail embedded in them, when they have one, instead
+                of converting them. Defaults to True.
+            image_dpi (int, optional): Resolution images are downscaled to at
+                their display width in the report. Defaults to 150.
+            vector_pdf (bool, optional): Keep the previewed PDF pages (of PDF
+                files and of converted Word and Excel files) as vector PDF
+                pages instead of rasterizing them. Only PDF reports show them
+                as such. Defaults to False.
+        """
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.zoom = zoom
+        self.converter = converter
+        self.converter_recycle = converter_recycle
+        self.word_pages = word_pages
+        self.excel_pages = excel_pages
+        self.tail_extensions = tuple(sorted(
+            ('.' + extension.lstrip('.')).lower() for extension in tail_extensions))
+        self.csv_profile = csv_profile
+        self.csv_profile_rows = csv_profile_rows
+        self.excel_sheets = excel_sheets
+        self.excel_sheet_jobs = excel_sheet_jobs
+        self.use_thumbnails = use_thumbnails
+        self.image_dpi = image_dpi
+        self.vector_pdf = vector_pdf
+    
+    def replace(self, **changes):
+        """
+        Get a copy of the settings with some values changed.
+        
+        Args:
+            **changes: New values of settings
+            
+        Returns:
+            RenderSettings: The modified copy
+        """
+        settings = copy.copy(self)
+        for name, value in changes.items():
+            setattr(settings, name, value)
+        return settings
+    
+    def cache_key(self):
+        """
+        Get a stable representation of the settings for cache keys.
+        
+        Returns:
+            str: Sorted repr of all setting values that affect the output
+        """
+        return repr(sorted((name, value) for name, value in vars(self).items()
+                           if name not in self.NON_OUTPUT_SETTINGS))
+
+
+# Heading level of the subheadings within a file's section
+SUBHEADING_LEVEL = 3
 
 
-def process_word(file_path, doc):
+class FilePreview:
     """
-    Process a Word document and add its content to the report.
+    Self-contained preview of a single file.
     
-    First attempts to convert to PDF and process as image,
-    falls back to direct text extraction if conversion fails.
+    Processors record pictures, paragraphs and tables here instead of writing
+    them straight into the report. A preview only holds plain data, so it can
+    be built in a worker process and appended to the report by the main process.
+    """
     
-    Args:
-        file_path (str): Path to the Word document
-        doc (Document): Word document object
+    def __init__(self):
+        self.blocks = []
+        # Set by processors when the preview could not be produced, so that
+        # transient failures are not cached
+        self.failed = False
+        # Digest of the serialized preview, set once it has been cached
+        self.digest = None
+        # Seconds spent in each processing phase; not cached
+        self.timings = {}
+    
+    def add_picture(self, image_data, width=6.0):
+        """
+        Record an image.
         
-    Returns:
-        None
+        Args:
+            image_data (bytes): Encoded image data (PNG, JPEG, ...)
+            width (float, optional): Display width in inches. Defaults to 6.0.
+        """
+        self.blocks.append(('picture', image_data, width))
+    
+    def add_pdf_page(self, pdf_data, width=6.0):
+        """
+        Record a PDF page to be shown as vector content.
+        
+        Args:
+            pdf_data (bytes): PDF document holding the page as its only page
+            width (float, optional): Display width in inches. Defaults to 6.0.
+        """
+        self.blocks.append(('pdf_page', pdf_data, width))
+    
+    def add_paragraph(self, text=''):
+        """
+        Record a paragraph of plain text.
+        
+        Args:
+            text (str, optional): Paragraph text
+        """
+        self.blocks.append(('paragraph', text))
+    
+    def add_table(self, rows):
+        """
+        Record a table.
+        
+        Args:
+            rows (list): List of rows, each a list of cell strings
+        """
+        self.blocks.append(('table', rows))
+    
+    def add_heading(self, text, anchor):
+        """
+        Record a subheading within the file's section, e.g. one per sheet.
+        
+        Args:
+            text (str): Heading text
+            anchor (str): Suffix appended to the file's bookmark name to
+                bookmark the heading, unique within the preview
+        """
+        self.blocks.append(('heading', text, anchor))
+    
+    def write_to(self, report, bookmark_name=None):
+        """
+        Append the recorded blocks to a report.
+        
+        Args:
+            report (DocxReportWriter, StreamingDocxWriter or PdfReportWriter):
+                Report being built
+            bookmark_name (str, optional): Bookmark of the file's heading, used
+                to derive the bookmarks of subheadings. Without it subheadings
+                are not bookmarked.
+            
+        Returns:
+            None
+        """
+        for block in self.blocks:
+            kind = block[0]
+            if kind == 'heading':
+                report.add_heading(block[1], SUBHEADING_LEVEL,
+                                   f"{bookmark_name}_{block[2]}" if bookmark_name else None)
+            elif kind == 'picture':
+                report.add_picture(block[1], block[2])
+            elif kind == 'pdf_page':
+                report.add_pdf_page(block[1], block[2])
+            elif kind == 'paragraph':
+                report.add_paragraph(block[1])
+            elif kind == 'table':
+                report.add_table(block[1])
+
+
+class PreviewCache:
     """
-    try:
-        # Convert Word to PDF first
-        # Initialize COM in this thread
-        pythoncom.CoInitialize()
+    Persistent, content-addressed cache of finished file previews.
+    
+    Previews are stored once per distinct content under objects/ (named by the
+    SHA-256 of the serialized preview) and looked up through a small SQLite
+    index keyed by the source file's path, size, mtime (or content hash) and the
+    render settings. When the stored previews exceed max_bytes, the least
+    recently used ones are evicted.
+    
+    Stored previews hold only text, numbers and raw image/PDF data, so a
+    shared cache directory cannot make loading run code. The index is
+    committed as previews are stored, so a crashed run keeps what it cached
+    and other runs can use the same cache directory meanwhile.
+    """
+    
+    # Bump when processor output changes so that stale previews are not reused
+    VERSION = 6
+    
+    # Marks the serialized preview format
+    FORMAT = b'DCPREVIEW1\n'
+    
+    # Last-use times of loaded previews are written to the index in batches
+    TOUCH_BATCH = 100
+    
+    # Eviction frees space down to this fraction of max_bytes, so that it
+    # does not run again on every following put
+    EVICT_LOW_WATER = 0.9
+    
+    # Least recently used previews read from the index at a time when evicting
+    EVICT_BATCH = 256
+    
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, hash_content=False):
+        """
+        Args:
+            cache_dir (str): Directory holding the cache
+            max_bytes (int, optional): Size cap for stored previews, 0 for no
+                cap. Defaults to 1 GiB.
+            hash_content (bool, optional): Key entries by a hash of the file
+                content instead of its mtime. Survives touched or re-copied
+                files at the cost of reading each file. Defaults to False.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.hits = 0
+        self.misses = 0
+        # Last-use times of loaded previews not yet written to the index
+        self.touched = {}
+        os.makedirs(self.objects_dir, exist_ok=True)
+        
+        # Wait for other runs writing to the same index instead of failing
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'), timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS objects '
+                        '(digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS objects_lru ON objects (last_used)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)')
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+        self.db.commit()
+    
+    def make_key(self, file_path, settings):
+        """
+        Build the cache key for a file.
         
-        # Create new Word instance without affecting others
-        word = win32com.client.DispatchEx("Word.Application")
-        word.Visible = False
+        Args:
+            file_path (str): Path to the source file
+            settings (RenderSettings): Render settings the preview is built with
+            
+        Returns:
+            str: Hex digest identifying the file version and settings
+        """
+        st = os.stat(file_path)
+        if self.hash_content:
+            content_hash = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    content_hash.update(block)
+            version = content_hash.hexdigest()
+        else:
+            version = st.st_mtime_ns
+        parts = (self.VERSION, os.path.abspath(file_path), st.st_size, version, settings.cache_key())
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+    
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+    
+    @classmethod
+    def serialize(cls, blocks):
+        """
+        Serialize preview blocks.
         
-        # Convert to absolute path
-        abs_path = os.path.abspath(file_path)
-        pdf_path = abs_path.rsplit('.', 1)[0] + '.pdf'
+        The blocks are written as JSON, followed by the raw bytes of their
+        binary values (images, PDF pages).
         
-        # Open and convert
-        try:
-            wb = word.Documents.Open(abs_path)
-            wb.SaveAs(pdf_path, FileFormat=17)  # 17 represents PDF format
-            wb.Close()
+        Args:
+            blocks (list): Blocks of a FilePreview
             
-            # Release Word application instead of quitting
-            word = None
-            pythoncom.CoUninitialize()
+        Returns:
+            bytes: Serialized blocks
+        """
+        payloads = []
+        encoded = []
+        for block in blocks:
+            values = []
+            for value in block:
+                if isinstance(value, bytes):
+                    payloads.append(value)
+                    value = {'bytes': len(value)}
+                values.append(value)
+            encoded.append(values)
+        header = json.dumps(encoded, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return b''.join([cls.FORMAT, len(header).to_bytes(8, 'big'), header] + payloads)
+    
+    @classmethod
+    def deserialize(cls, data):
+        """
+        Restore preview blocks serialized by serialize.
+        
+        Args:
+            data (bytes): Serialized blocks
             
-            # Now process the PDF using existing PDF processing function
-            process_pdf(pdf_path, doc)
+        Returns:
+            list: Blocks of a FilePreview
             
-            # Clean up the temporary PDF
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-                
-        except Exception as word_error:
-            print(f"Error converting Word to PDF: {str(word_error)}")
+        Raises:
+            ValueError: If the data is not a serialized preview
+        """
+        if not data.startswith(cls.FORMAT):
+            raise ValueError("Not a serialized preview")
+        offset = len(cls.FORMAT) + 8
+        header_end = offset + int.from_bytes(data[len(cls.FORMAT):offset], 'big')
+        encoded = json.loads(data[offset:header_end].decode('utf-8'))
+        
+        blocks = []
+        offset = header_end
+        for values in encoded:
+            block = []
+            for value in values:
+                if isinstance(value, dict):
+                    size = value['bytes']
+                    if offset + size > len(data):
+                        raise ValueError("Truncated serialized preview")
+                    value = data[offset:offset + size]
+                    offset += size
+                block.append(value)
+            blocks.append(tuple(block))
+        return blocks
+    
+    def _write_touched(self):
+        """Write the pending last-use times to the index."""
+        if self.touched:
+            self.db.executemany('UPDATE objects SET last_used = ? WHERE digest = ?',
+                                [(last_used, digest) for digest, last_used in self.touched.items()])
+            self.touched.clear()
+    
+    def load(self, digest):
+        """
+        Load a stored preview by its digest.
+        
+        Args:
+            digest (str): Digest of the serialized preview
             
-            # Release Word before falling back
-            if word:
-                word = None
-            pythoncom.CoUninitialize()
+        Returns:
+            FilePreview: The preview, or None if it is not stored
+        """
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                blocks = self.deserialize(f.read())
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        self.touched[digest] = time.time()
+        if len(self.touched) >= self.TOUCH_BATCH:
+            self._write_touched()
+            self.db.commit()
+        preview = FilePreview()
+        preview.blocks = blocks
+        preview.digest = digest
+        return preview
+    
+    def get(self, key):
+        """
+        Look up the preview stored for a cache key.
+        
+        Args:
+            key (str): Key returned by make_key
             
-            # Fallback to original Word processing method
-            src_doc = Document(file_path)
+        Returns:
+            FilePreview: The cached preview, or None on a miss
+        """
+        row = self.db.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+        preview = self.load(row[0]) if row else None
+        if preview is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return preview
+    
+    def put(self, key, preview):
+        """
+        Store a preview under a cache key.
+        
+        Failed previews are not stored. Sets preview.digest.
+        
+        Args:
+            key (str): Key returned by make_key
+            preview (FilePreview): Preview to store
             
-            # Add first page content
-            for paragraph in src_doc.paragraphs:
-                doc.add_paragraph(paragraph.text)
-                
-            # Add first page tables
-            for table in src_doc.tables:
-                new_table = doc.add_table(rows=len(table.rows), cols=len(table.columns))
-                new_table.style = 'Table Grid'
-                for i, row in enumerate(table.rows):
-                    for j, cell in enumerate(row.cells):
-                        new_table.cell(i, j).text = cell.text
-                doc.add_paragraph()  # Add spacing after table
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
+        Returns:
+            str: Digest of the stored preview, or None if it was not stored
+        """
+        if preview.failed:
+            return None
+        data = self.serialize(preview.blocks)
+        digest = hashlib.sha256(data).hexdigest()
+        preview.digest = digest
+        
+        if self.db.execute('SELECT 1 FROM objects WHERE digest = ?', (digest,)).fetchone() is None:
+            object_path = self._object_path(digest)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f"{object_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, object_path)
+            self.db.execute('INSERT INTO objects (digest, size, last_used) VALUES (?, ?, ?)',
+                            (digest, len(data), time.time()))
+            self.total_bytes += len(data)
+        self.db.execute('INSERT OR REPLACE INTO entries (key, digest) VALUES (?, ?)', (key, digest))
+        
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+        self._write_touched()
+        self.db.commit()
+        return digest
+    
+    def evict(self):
+        """
+        Remove least recently used previews until the cache fits max_bytes.
+        
+        Frees space down to EVICT_LOW_WATER of max_bytes.
+        
+        Returns:
+            None
+        """
+        self._write_touched()
+        target = self.max_bytes * self.EVICT_LOW_WATER
+        while self.total_bytes > target:
+            rows = self.db.execute('SELECT digest, size FROM objects ORDER BY last_used LIMIT ?',
+                                   (self.EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for digest, size in rows:
+                if self.total_bytes <= target:
+                    break
+                self._remove(digest, size)
+    
+    def prune(self, keep_digests):
+        """
+        Remove all stored previews except the given ones.
+        
+        Args:
+            keep_digests (set): Digests of the previews to keep
+            
+        Returns:
+            None
+        """
+        self._write_touched()
+        for digest, size in self.db.execute('SELECT digest, size FROM objects').fetchall():
+            if digest not in keep_digests:
+                self._remove(digest, size)
+        self.db.commit()
+    
+    def _remove(self, digest, size):
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+        self.db.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+        self.db.execute('DELETE FROM entries WHERE digest = ?', (digest,))
+        self.total_bytes -= size
+    
+    def close(self):
+        """
+        Enforce the size cap, commit the index and close the cache.
+        
+        Returns:
+            None
+        """
+        self._write_touched()
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+        self.db.commit()
+        self.db.close()
 
 
-def process_excel(file_path, doc):
+def render_pdf_page(page, settings):
     """
-    Process an Excel file and add its content to the report.
+    Rasterize a PDF page into encoded image bytes.
     
-    First attempts to convert to PDF, falls back to direct data
-    extraction using openpyxl if conversion fails.
+    The pixmap is encoded in memory, no temporary file is written.
     
     Args:
-        file_path (str): Path to the Excel file
-        doc (Document): Word document object
+        page (Page): PyMuPDF page object
+        settings (RenderSettings): Render settings (zoom, format, quality)
+        
+    Returns:
+        bytes: Encoded PNG or JPEG image
+    """
+    mat = fitz.Matrix(settings.zoom, settings.zoom)
+    pix = page.get_pixmap(matrix=mat)
+    if settings.image_format == 'jpeg':
+        return pix.tobytes('jpeg', jpg_quality=settings.jpeg_quality)
+    return pix.tobytes('png')
+
+
+def extract_pdf_page(pdf, page_number=0):
+    """
+    Copy a page of a PDF into a PDF of its own.
+    
+    The page keeps its vector content; only the resources it uses are
+    carried over.
+    
+    Args:
+        pdf (Document): PyMuPDF document
+        page_number (int, optional): Zero-based page number. Defaults to 0.
+        
+    Returns:
+        bytes: PDF document holding the page
+    """
+    with fitz.open() as page_pdf:
+        page_pdf.insert_pdf(pdf, from_page=page_number, to_page=page_number, links=False, annots=False)
+        return page_pdf.tobytes(garbage=3, deflate=True)
+
+
+def process_pdf(file_path, preview, settings=None):
+    """
+    Process a PDF file and add its first page to the preview.
+    
+    The page is rasterized, or copied as a vector PDF page with
+    settings.vector_pdf.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        preview (FilePreview): Preview to record the page image into
+        settings (RenderSettings, optional): Render settings. Defaults to RenderSettings().
         
     Returns:
         None
     """
+    settings = settings or RenderSettings()
     try:
-        # Convert Excel to PDF first
+        with fitz.open(file_path) as pdf:
+            if settings.vector_pdf:
+                preview.add_pdf_page(extract_pdf_page(pdf), width=6)
+            else:
+                preview.add_picture(render_pdf_page(pdf[0], settings), width=6)
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+
+
+class ConverterCrashed(Exception):
+    """Raised when a converter instance died and has to be replaced."""
+
+
+class ConverterBackend:
+    """
+    A long-lived converter instance that turns Word and Excel files into PDF.
+    
+    Instances are managed by a ConverterPool, which starts them, checks their
+    health before use and recycles them after a number of documents.
+    """
+    
+    name = None
+    
+    @classmethod
+    def is_available(cls):
+        """
+        Check whether this backend can run on this machine.
+        
+        Returns:
+            bool: True if instances can be started
+        """
+        return False
+    
+    def start(self):
+        """
+        Start the converter instance.
+        
+        Returns:
+            None
+        """
+    
+    def convert(self, file_path, pdf_path, kind, pages=0):
+        """
+        Convert a document to PDF.
+        
+        Args:
+            file_path (str): Absolute path of the source document
+            pdf_path (str): Absolute path of the PDF to write
+            kind (str): 'word' or 'excel'
+            pages (int, optional): Number of leading pages to export, 0 for
+                the whole document. Defaults to 0.
+            
+        Returns:
+            None
+        """
+        raise NotImplementedError
+    
+    def is_alive(self):
+        """
+        Check that the instance can still take documents.
+        
+        Returns:
+            bool: True if the instance is healthy
+        """
+        return True
+    
+    def stop(self):
+        """
+        Stop the converter instance, ignoring errors.
+        
+        Returns:
+            None
+        """
+
+
+class OfficeComBackend(ConverterBackend):
+    """
+    Converter backed by Microsoft Word and Excel through COM.
+    
+    The Word and Excel applications are started on first use and kept
+    running for the following documents. COM objects belong to the thread
+    that created them, so an instance must be used from a single thread.
+    """
+    
+    name = 'office'
+    
+    # ProgIDs of the applications used for each kind of document
+    APPLICATIONS = {
+        'word': "Word.Application",
+        'excel': "Excel.Application",
+    }
+    
+    @classmethod
+    def is_available(cls):
+        return win32com is not None
+    
+    def __init__(self):
+        self._apps = {}
+    
+    def start(self):
         # Initialize COM in this thread
         pythoncom.CoInitialize()
+    
+    def _get_app(self, kind):
+        app = self._apps.get(kind)
+        if app is None:
+            # Create new instance without affecting others
+            app = win32com.client.DispatchEx(self.APPLICATIONS[kind])
+            app.Visible = False
+            app.DisplayAlerts = False
+            self._apps[kind] = app
+        return app
+    
+    def convert(self, file_path, pdf_path, kind, pages=0):
+        app = self._get_app(kind)
+        if kind == 'word':
+            wb = app.Documents.Open(file_path, ReadOnly=True)
+            try:
+                if pages:
+                    # 17 represents PDF format, Range 3 exports pages From..To
+                    wb.ExportAsFixedFormat(OutputFileName=pdf_path, ExportFormat=17,
+                                           Range=3, From=1, To=pages)
+                else:
+                    wb.SaveAs(pdf_path, FileFormat=17)  # 17 represents PDF format
+            finally:
+                wb.Close(False)
+        else:
+            wb = app.Workbooks.Open(file_path, ReadOnly=True)
+            try:
+                if pages:
+                    wb.ExportAsFixedFormat(0, pdf_path, From=1, To=pages)  # 0 represents PDF format
+                else:
+                    wb.ExportAsFixedFormat(0, pdf_path)
+            finally:
+                wb.Close(False)
+    
+    def is_alive(self):
+        try:
+            for app in self._apps.values():
+                app.Name  # Fails once the application is gone
+            return True
+        except Exception:
+            return False
+    
+    def stop(self):
+        for app in self._apps.values():
+            try:
+                app.Quit()
+            except Exception:
+                pass
+        self._apps = {}
+        pythoncom.CoUninitialize()
+
+
+class LibreOfficeBackend(ConverterBackend):
+    """
+    Converter backed by a headless LibreOffice listener.
+    
+    Each instance starts its own soffice process with a private profile and
+    keeps it listening on a named pipe, so documents are converted through
+    the UNO bridge without paying the soffice startup for every file.
+    """
+    
+    name = 'libreoffice'
+    
+    # Executable names tried in order
+    EXECUTABLES = ('soffice', 'libreoffice')
+    
+    # Seconds to wait for a new listener to accept connections
+    STARTUP_TIMEOUT = 60
+    
+    # PDF export filters for each kind of document
+    FILTERS = {
+        'word': 'writer_pdf_Export',
+        'excel': 'calc_pdf_Export',
+    }
+    
+    @classmethod
+    def find_executable(cls):
+        """
+        Find the LibreOffice executable on the PATH.
         
-        # Create new Excel instance without affecting others
-        excel = win32com.client.DispatchEx("Excel.Application")
-        excel.Visible = False
-        excel.DisplayAlerts = False
-        
-        # Convert to absolute path
-        abs_path = os.path.abspath(file_path)
-        pdf_path = abs_path.rsplit('.', 1)[0] + '.pdf'
+        Returns:
+            str: Path of the executable, or None if it is not installed
+        """
+        for name in cls.EXECUTABLES:
+            path = shutil.which(name)
+            if path:
+                return path
+        return None
+    
+    @classmethod
+    def is_available(cls):
+        return uno is not None and cls.find_executable() is not None
+    
+    def __init__(self):
+        self._process = None
+        self._profile_dir = None
+        self._desktop = None
+    
+    def start(self):
+        self._profile_dir = tempfile.mkdtemp(prefix='document_converter_soffice_')
+        pipe_name = os.path.basename(self._profile_dir)
+        self._process = subprocess.Popen(
+            [self.find_executable(), '--headless', '--invisible', '--nologo', '--norestore',
+             '--nodefault', '--nolockcheck',
+             '-env:UserInstallation=' + uno.systemPathToFileUrl(self._profile_dir),
+             f'--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context)
+        deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                # The listener is not accepting connections yet
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise ConverterCrashed("LibreOffice listener did not start")
+                time.sleep(0.25)
+        self._desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context)
+    
+    @staticmethod
+    def _properties(**values):
+        return tuple(PropertyValue(Name=name, Value=value) for name, value in values.items())
+    
+    def convert(self, file_path, pdf_path, kind, pages=0):
+        doc = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(file_path), "_blank", 0,
+            self._properties(Hidden=True, ReadOnly=True))
+        if doc is None:
+            raise ValueError("LibreOffice could not open the document")
         try:
-            # Open and convert
-            wb = excel.Workbooks.Open(abs_path)
-            wb.ExportAsFixedFormat(0, pdf_path)  # 0 represents PDF format
-            wb.Close(False)
-            
-            # Release Excel application instead of quitting
-            excel = None
-            pythoncom.CoUninitialize()
-            
-            # Now process the PDF using existing PDF processing function
-            process_pdf(pdf_path, doc)
-            
-            # Clean up the temporary PDF
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-                
-        except Exception as excel_error:
-            print(f"Error converting Excel to PDF: {str(excel_error)}")
-            
-            # Release Excel before falling back
-            if excel:
-                excel = None
-            pythoncom.CoUninitialize()
+            export_properties = self._properties(FilterName=self.FILTERS[kind])
+            if pages:
+                # The filter options are a nested property sequence, which
+                # has to be passed as an explicitly typed Any
+                filter_data = uno.Any("[]com.sun.star.beans.PropertyValue",
+                                      self._properties(PageRange=f"1-{pages}"))
+                export_properties += self._properties(FilterData=filter_data)
+            uno.invoke(doc, "storeToURL", (uno.systemPathToFileUrl(pdf_path), export_properties))
+        finally:
+            doc.close(True)
+    
+    def is_alive(self):
+        if self._process is None or self._process.poll() is not None:
+            return False
+        try:
+            self._desktop.getComponents()  # Fails once the bridge is gone
+            return True
+        except Exception:
+            return False
+    
+    def stop(self):
+        if self._desktop is not None:
+            try:
+                self._desktop.terminate()
+            except Exception:
+                pass
+            self._desktop = None
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        if self._profile_dir is not None:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+
+class FakeBackend(ConverterBackend):
+    """
+    In-process stand-in for a real converter.
+    
+    Writes a one-page PDF naming the source document. It makes the pooling,
+    recycling and crash recovery usable and testable on machines without
+    Office. crash_after simulates a converter that dies after that many
+    documents. page_count is the length of the simulated source documents.
+    """
+    
+    name = 'fake'
+    
+    @classmethod
+    def is_available(cls):
+        return True
+    
+    def __init__(self, crash_after=None, page_count=1):
+        self.crash_after = crash_after
+        self.page_count = page_count
+        self.documents = 0
+        self.running = False
+    
+    def start(self):
+        self.running = True
+    
+    def convert(self, file_path, pdf_path, kind, pages=0):
+        if not self.running:
+            raise ConverterCrashed("fake converter is not running")
+        if self.crash_after is not None and self.documents >= self.crash_after:
+            self.running = False
+            raise ConverterCrashed("fake converter crashed")
+        self.documents += 1
+        with fitz.open() as pdf:
+            for number in range(1, min(pages or self.page_count, self.page_count) + 1):
+                page = pdf.new_page()
+                page.insert_text((72, 72), f"{kind} document: {os.path.basename(file_path)}, page {number}")
+            pdf.save(pdf_path)
+    
+    def is_alive(self):
+        return self.running
+    
+    def stop(self):
+        self.running = False
+
+
+# Converter backends by name, in order of preference for 'auto'
+CONVERTER_BACKENDS = {
+    'office': OfficeComBackend,
+    'libreoffice': LibreOfficeBackend,
+    'fake': FakeBackend,
+}
+
+
+class ConverterPool:
+    """
+    Pool of warm, reusable converter instances.
+    
+    Instances are started on demand up to size and reused across documents.
+    Each instance is health-checked before use, replaced if it crashed while
+    converting (the document is then retried once on a fresh instance), and
+    recycled after max_documents conversions to contain leaks in long runs.
+    """
+    
+    def __init__(self, backend_factory, size=1, max_documents=50):
+        """
+        Args:
+            backend_factory (callable): Returns a new, not yet started ConverterBackend
+            size (int, optional): Maximum number of instances. Defaults to 1.
+            max_documents (int, optional): Documents converted by an instance
+                before it is recycled, 0 to never recycle. Defaults to 50.
+        """
+        self.backend_factory = backend_factory
+        self.size = size
+        self.max_documents = max_documents
+        self.started = 0
+        self.recycled = 0
+        self.crashed = 0
+        self._idle = []
+        self._count = 0
+        self._documents = {}
+        self._condition = threading.Condition()
+    
+    def _start_instance(self):
+        instance = self.backend_factory()
+        instance.start()
+        self.started += 1
+        self._documents[id(instance)] = 0
+        return instance
+    
+    def _stop(self, instance):
+        self._documents.pop(id(instance), None)
+        try:
+            instance.stop()
+        except Exception:
+            pass
+    
+    def _free_slot(self):
+        with self._condition:
+            self._count -= 1
+            self._condition.notify()
+    
+    def _discard(self, instance):
+        self._stop(instance)
+        self._free_slot()
+    
+    def _acquire(self):
+        with self._condition:
+            while not self._idle and self._count >= self.size:
+                self._condition.wait()
+            if self._idle:
+                instance = self._idle.pop()
+            else:
+                instance = None
+                self._count += 1
+        if instance is not None and not instance.is_alive():
+            # Died while idle: start a replacement in the same slot
+            self.crashed += 1
+            self._stop(instance)
+            instance = None
+        if instance is None:
+            try:
+                instance = self._start_instance()
+            except Exception:
+                self._free_slot()
+                raise
+        return instance
+    
+    def _release(self, instance):
+        if self.max_documents and self._documents[id(instance)] >= self.max_documents:
+            self.recycled += 1
+            self._discard(instance)
+            return
+        with self._condition:
+            self._idle.append(instance)
+            self._condition.notify()
+    
+    def convert(self, file_path, pdf_path, kind, pages=0):
+        """
+        Convert a document to PDF on a pooled instance.
+        
+        Args:
+            file_path (str): Absolute path of the source document
+            pdf_path (str): Absolute path of the PDF to write
+            kind (str): 'word' or 'excel'
+            pages (int, optional): Number of leading pages to export, 0 for
+                the whole document. Defaults to 0.
             
-            # Fallback to openpyxl method
+        Returns:
+            None
+        """
+        for attempt in range(2):
+            instance = self._acquire()
             try:
-                wb = openpyxl.load_workbook(file_path, data_only=True)
-                sheet = wb.active
-                
-                # Create a table with the first 10 rows and 10 columns of data
-                table = doc.add_table(rows=1, cols=0)
-                table.style = 'Table Grid'
-                
-                # Determine max columns to display (up to 10)
-                max_col = min(10, sheet.max_column)
-                max_row = min(11, sheet.max_row)  # Header + 10 rows
-                
-                # Add header row
-                header_cells = table.rows[0].cells
-                for col in range(1, max_col + 1):
-                    if len(header_cells) < col:
-                        header_cells = table.add_column().cells
-                    cell_value = sheet.cell(row=1, column=col).value
-                    if cell_value is not None:
-                        header_cells[col-1].text = str(cell_value)
-                
-                # Add data rows
-                for row in range(2, max_row + 1):
-                    cells = table.add_row().cells
-                    for col in range(1, max_col + 1):
-                        cell_value = sheet.cell(row=row, column=col).value
-                        if cell_value is not None:
-                            cells[col-1].text = str(cell_value)
-                
-                doc.add_paragraph("Excel data extracted directly using openpyxl.")
-                
-            except Exception as openpyxl_error:
-                print(f"Error processing Excel file: {str(openpyxl_error)}")
-                doc.add_paragraph(f"Failed to process Excel file: {str(openpyxl_error)}")
-                
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
-        doc.add_paragraph(f"Error processing {file_path}: {str(e)}")
+                instance.convert(file_path, pdf_path, kind, pages)
+            except Exception:
+                if instance.is_alive():
+                    # The document failed, the instance is fine
+                    self._documents[id(instance)] += 1
+                    self._release(instance)
+                    raise
+                # The instance crashed: replace it and retry the document once
+                self.crashed += 1
+                self._discard(instance)
+                if attempt:
+                    raise
+                continue
+            self._documents[id(instance)] += 1
+            self._release(instance)
+            return
+    
+    def close(self):
+        """
+        Stop all idle instances.
+        
+        Returns:
+            None
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for instance in idle:
+            self._discard(instance)
+
+
+# Converter pool of this process, created on first use
+_converter_pool = None
+_converter_pool_key = None
+
+
+def get_converter_pool(settings):
+    """
+    Get this process's converter pool for the given settings.
+    
+    Every process (the main one and each worker) keeps its own pool, so the
+    converter instances stay warm across all the files it processes.
+    
+    Args:
+        settings (RenderSettings): Render settings (converter, converter_recycle)
+        
+    Returns:
+        ConverterPool: The pool, or None if no converter is available
+    """
+    global _converter_pool, _converter_pool_key
+    key = (settings.converter, settings.converter_recycle)
+    if _converter_pool is not None and _converter_pool_key == key:
+        return _converter_pool
+    close_converter_pool()
+    
+    if settings.converter == 'auto':
+        names = [name for name, backend in CONVERTER_BACKENDS.items()
+                 if name != 'fake' and backend.is_available()]
+    elif settings.converter in CONVERTER_BACKENDS and CONVERTER_BACKENDS[settings.converter].is_available():
+        names = [settings.converter]
+    else:
+        names = []
+    if not names:
+        return None
+    
+    _converter_pool = ConverterPool(CONVERTER_BACKENDS[names[0]], max_documents=settings.converter_recycle)
+    _converter_pool_key = key
+    # Stop the instances when this process exits; also runs in pool workers
+    multiprocessing.util.Finalize(None, close_converter_pool, exitpriority=10)
+    return _converter_pool
+
+
+def close_converter_pool():
+    """
+    Stop this process's converter instances.
+    
+    Returns:
+        None
+    """
+    global _converter_pool, _converter_pool_key
+    if _converter_pool is not None:
+        _converter_pool.close()
+    _converter_pool = None
+    _converter_pool_key = None
+
+
+# Relationship type of the thumbnail part of OOXML packages
+THUMBNAIL_RELTYPE = 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail'
+
+# Thumbnail part of ODF packages
+ODF_THUMBNAIL = 'Thumbnails/thumbnail.png'
+
+# Thumbnail formats that can be embedded; others (e.g. WMF, EMF) are ignored
+THUMBNAIL_FORMATS = ('JPEG', 'PNG', 'GIF', 'BMP')
+
+# Templates whose thumbnail is inherited by the documents created from them
+THUMBNAIL_TEMPLATES = (
+    os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx'),
+)
+
+# Digests of the template thumbnails, loaded on first use
+_template_thumbnail_digests = None
+
+
+def get_template_thumbnail_digests():
+    """
+    Get the digests of the thumbnails of THUMBNAIL_TEMPLATES.
+    
+    Documents generated by python-docx keep the thumbnail of its default
+    template, a blank page, which must not be mistaken for their preview.
+    
+    Returns:
+        set: SHA-256 hex digests
+    """
+    global _template_thumbnail_digests
+    if _template_thumbnail_digests is None:
+        _template_thumbnail_digests = set()
+        for template in THUMBNAIL_TEMPLATES:
+            try:
+                with zipfile.ZipFile(template) as archive:
+                    data = archive.read('docProps/thumbnail.jpeg')
+            except (OSError, KeyError, zipfile.BadZipFile):
+                continue
+            _template_thumbnail_digests.add(hashlib.sha256(data).hexdigest())
+    return _template_thumbnail_digests
+
+
+def read_embedded_thumbnail(file_path):
+    """
+    Read the thumbnail stored inside an OOXML or ODF document.
+    
+    OOXML packages reference it from their package relationships (usually
+    docProps/thumbnail.jpeg); ODF packages store Thumbnails/thumbnail.png.
+    Thumbnails inherited from a template are ignored.
+    
+    Args:
+        file_path (str): Path to the document
+        
+    Returns:
+        bytes: Encoded thumbnail image, or None if the file has none
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            names = set(archive.namelist())
+            candidates = []
+            if '_rels/.rels' in names:
+                rels = etree.fromstring(archive.read('_rels/.rels'))
+                candidates += [rel.get('Target', '').lstrip('/') for rel in rels
+                               if rel.get('Type') == THUMBNAIL_RELTYPE]
+            candidates.append(ODF_THUMBNAIL)
+            for name in candidates:
+                if name in names:
+                    data = archive.read(name)
+                    if hashlib.sha256(data).hexdigest() in get_template_thumbnail_digests():
+                        continue
+                    with Image.open(BytesIO(data)) as img:
+                        if img.format in THUMBNAIL_FORMATS:
+                            return data
+    except (zipfile.BadZipFile, OSError, KeyError, etree.XMLSyntaxError):
+        # Not a zip package (e.g. a legacy .doc or .xls) or a broken thumbnail
+        pass
+    return None
+
+
+def add_embedded_thumbnail(file_path, preview, settings):
+    """
+    Use a document's embedded thumbnail as its preview, if it has one.
+    
+    Args:
+        file_path (str): Path to the document
+        preview (FilePreview): Preview to record the thumbnail into
+        settings (RenderSettings): Render settings (use_thumbnails)
+        
+    Returns:
+        bool: True if the thumbnail was used, so no conversion is needed
+    """
+    if not settings.use_thumbnails:
+        return False
+    start = time.perf_counter()
+    thumbnail = read_embedded_thumbnail(file_path)
+    preview.timings['thumbnail'] = time.perf_counter() - start
+    if thumbnail is None:
+        return False
+    preview.add_picture(thumbnail, width=6.0)
+    preview.add_paragraph("Preview taken from the thumbnail embedded in the file.")
+    return True
+
+
+def convert_and_process_pdf(file_path, kind, preview, settings):
+    """
+    Convert a Word or Excel file to PDF and add its first page to the preview.
+    
+    Only the leading pages configured for the kind (settings.word_pages or
+    settings.excel_pages) are exported. The time spent converting and
+    rendering is recorded in preview.timings.
+    
+    Args:
+        file_path (str): Path to the document
+        kind (str): 'word' or 'excel'
+        preview (FilePreview): Preview to record the page image into
+        settings (RenderSettings): Render settings
+        
+    Returns:
+        bool: False if no converter is available or the conversion failed,
+            so the caller should fall back to direct extraction
+    """
+    pool = get_converter_pool(settings)
+    if pool is None:
+        return False
+    
+    # Convert to absolute path
+    abs_path = os.path.abspath(file_path)
+    
+    # Write the intermediate PDF to a private directory, never next to the source
+    with tempfile.TemporaryDirectory(prefix='document_converter_') as pdf_dir:
+        pdf_path = os.path.join(pdf_dir, os.path.splitext(os.path.basename(abs_path))[0] + '.pdf')
+        pages = settings.word_pages if kind == 'word' else settings.excel_pages
+        start = time.perf_counter()
+        try:
+            pool.convert(abs_path, pdf_path, kind, pages)
+        except Exception as convert_error:
+            label = 'Word' if kind == 'word' else 'Excel'
+            print(f"Error converting {label} to PDF: {str(convert_error)}")
+            return False
+        finally:
+            preview.timings['convert'] = time.perf_counter() - start
+        
+        # Now process the PDF using existing PDF processing function
+        start = time.perf_counter()
+        process_pdf(pdf_path, preview, settings)
+        preview.timings['render'] = time.perf_counter() - start
+    preview.add_paragraph("First page rendered from a PDF conversion.")
+    return True
+
+
+def process_word(file_path, preview, settings=None):
+    """
+    Process a Word document and add its content to the preview.
+    
+    First attempts to convert to PDF and process as image,
+    falls back to direct text extraction if conversion fails.
+    
+    Args:
+        file_path (str): Path to the Word document
+        preview (FilePreview): Preview to record the content into
+        settings (RenderSettings, optional): Render settings. Defaults to RenderSettings().
+        
+    Returns:
+        None
+    """
+    settings = settings or RenderSettings()
+    try:
+        # An embedded thumbnail needs no conversion at all
+        if add_embedded_thumbnail(file_path, preview, settings):
+            return
+        
+        # Convert Word to PDF first, on a warm converter instance
+        converted = convert_and_process_pdf(file_path, 'word', preview, settings)
+        
+        if not converted:
+            # Fallback to original Word processing method
+            src_doc = Document(file_path)
+            
+            # Add first page content
+            for paragraph in src_doc.paragraphs:
+                preview.add_paragraph(paragraph.text)
+                
+            # Add first page tables
+            for table in src_doc.tables:
+                preview.add_table([[cell.text for cell in row.cells] for row in table.rows])
+                preview.add_paragraph()  # Add spacing after table
+            
+            preview.add_paragraph("Word content extracted directly using python-docx.")
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+
+
+# Size of the block of cells shown for a sheet: header + 10 rows, 10 columns
+EXCEL_PREVIEW_ROWS = 11
+EXCEL_PREVIEW_COLS = 10
+
+
+def read_sheet_preview(sheet, max_rows=EXCEL_PREVIEW_ROWS, max_cols=EXCEL_PREVIEW_COLS):
+    """
+    Read the top-left block of data of a worksheet.
+    
+    The sheet's recorded dimensions are ignored, as formatting often
+    inflates them: rows are streamed from the start of the sheet, empty
+    leading rows and columns are skipped, and reading stops as soon as the
+    block is filled.
+    
+    Args:
+        sheet (Worksheet): Worksheet, preferably from a read-only workbook
+        max_rows (int, optional): Rows in the block. Defaults to EXCEL_PREVIEW_ROWS.
+        max_cols (int, optional): Columns in the block. Defaults to EXCEL_PREVIEW_COLS.
+        
+    Returns:
+        tuple: (rows, cell range) where rows is a list of rows of cell
+            strings and cell range the block's A1 reference, or ([], None)
+            if the sheet has no data
+    """
+    if hasattr(sheet, 'reset_dimensions'):
+        # Read-only sheets would pad every row up to the recorded dimensions
+        sheet.reset_dimensions()
+    
+    block = []
+    first_row = None
+    for row_number, values in enumerate(sheet.iter_rows(values_only=True), 1):
+        if first_row is None:
+            if all(value is None for value in values):
+                continue
+            first_row = row_number
+        block.append(values)
+        if len(block) == max_rows:
+            break
+    
+    # Trim empty trailing rows and find the columns holding data
+    while block and all(value is None for value in block[-1]):
+        block.pop()
+    used_cols = [i for values in block for i, value in enumerate(values) if value is not None]
+    if not used_cols:
+        return [], None
+    first_col = min(used_cols)
+    last_col = min(max(used_cols), first_col + max_cols - 1)
+    
+    rows = []
+    for values in block:
+        values = tuple(values[first_col:last_col + 1])
+        values += (None,) * (last_col + 1 - first_col - len(values))
+        rows.append([str(value) if value is not None else '' for value in values])
+    cell_range = (f"{get_column_letter(first_col + 1)}{first_row}:"
+                  f"{get_column_letter(last_col + 1)}{first_row + len(rows) - 1}")
+    return rows, cell_range
+
+
+# Workbooks smaller than this are read sheet by sheet in the calling process,
+# as starting sheet workers would take longer than reading them
+EXCEL_PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+# Namespaces of the workbook part listing the sheets
+SPREADSHEETML_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+@contextlib.contextmanager
+def open_read_only_workbook(file_path):
+    """
+    Open a workbook read-only with cell values instead of formulas.
+    
+    openpyxl rejects paths without an Excel extension, so the workbook is
+    read from an open file, which is closed along with the workbook. This
+    lets sniffed workbooks with any name be read.
+    
+    Args:
+        file_path (str): Path to the workbook
+        
+    Yields:
+        Workbook: The read-only workbook
+    """
+    with open(file_path, 'rb') as f:
+        wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        try:
+            yield wb
+        finally:
+            wb.close()
+
+
+def get_worksheet_names(file_path):
+    """
+    List the worksheets of a workbook in order, skipping chart sheets.
+    
+    Only the workbook part is parsed, unlike openpyxl.load_workbook which
+    also reads the shared strings of the whole workbook.
+    
+    Args:
+        file_path (str): Path to the .xlsx workbook
+        
+    Returns:
+        list: Worksheet names
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            workbook = etree.fromstring(archive.read('xl/workbook.xml'))
+            rels = etree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        worksheet_ids = {rel.get('Id') for rel in rels if rel.get('Type', '').endswith('/worksheet')}
+        names = [sheet.get('name') for sheet in workbook.iter(f'{{{SPREADSHEETML_NS}}}sheet')
+                 if sheet.get(f'{{{RELATIONSHIPS_NS}}}id') in worksheet_ids]
+        if names:
+            return names
+    except (KeyError, zipfile.BadZipFile, etree.XMLSyntaxError):
+        pass
+    # Unusual package layout: let openpyxl find the sheets
+    with open_read_only_workbook(file_path) as wb:
+        return [sheet.title for sheet in wb.worksheets]
+
+
+def is_ooxml_workbook(file_path):
+    """
+    Check whether a file is an OOXML workbook (.xlsx, .xlsm) openpyxl can read.
+    
+    Args:
+        file_path (str): Path to the workbook
+        
+    Returns:
+        bool: False for other workbooks, e.g. .xls and .ods
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            archive.getinfo('xl/workbook.xml')
+        return True
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return False
+
+
+def read_workbook_sheet(file_path, sheet_name):
+    """
+    Read the preview block of one sheet of a workbook.
+    
+    This is the unit of work handed to sheet workers: each opens the
+    workbook read-only and streams only its own sheet.
+    
+    Args:
+        file_path (str): Path to the workbook
+        sheet_name (str): Name of the worksheet
+        
+    Returns:
+        tuple: (rows, cell range) as returned by read_sheet_preview
+    """
+    with open_read_only_workbook(file_path) as wb:
+        return read_sheet_preview(wb[sheet_name])
+
+
+def read_workbook_sheets(file_path, max_sheets=0, jobs=0):
+    """
+    Read the preview blocks of the first worksheets of a workbook.
+    
+    The sheets of large workbooks are read concurrently in worker
+    processes, so the workbook takes about as long as its largest sheet.
+    
+    Args:
+        file_path (str): Path to the workbook
+        max_sheets (int, optional): Number of sheets to read, 0 for all of
+            them. Defaults to 0.
+        jobs (int, optional): Maximum number of worker processes, 0 for the
+            number of CPU cores. Defaults to 0.
+        
+    Returns:
+        list: (sheet name, rows, cell range) tuples, in workbook order
+    """
+    names = get_worksheet_names(file_path)
+    if max_sheets:
+        names = names[:max_sheets]
+    jobs = min(jobs or os.cpu_count() or 1, len(names))
+    
+    if jobs <= 1 or os.path.getsize(file_path) < EXCEL_PARALLEL_MIN_BYTES:
+        with open_read_only_workbook(file_path) as wb:
+            return [(name,) + read_sheet_preview(wb[name]) for name in names]
+    
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(read_workbook_sheet, file_path, name) for name in names]
+        return [(name,) + future.result() for name, future in zip(names, futures)]
+
+
+def add_excel_sheets(file_path, preview, settings):
+    """
+    Record the data of the first worksheets of a workbook, each under its
+    own subheading.
+    
+    Args:
+        file_path (str): Path to the workbook
+        preview (FilePreview): Preview to record the sheets into
+        settings (RenderSettings): Render settings (excel_sheets, excel_sheet_jobs)
+        
+    Returns:
+        None
+    """
+    sheets = read_workbook_sheets(file_path, settings.excel_sheets, settings.excel_sheet_jobs)
+    for index, (name, rows, cell_range) in enumerate(sheets, 1):
+        preview.add_heading(f"Sheet: {name}", f"sheet{index}")
+        if rows:
+            preview.add_table(rows)
+            preview.add_paragraph(f"Cells {cell_range}.")
+        else:
+            preview.add_paragraph("Sheet appears to be empty.")
+    if not sheets:
+        preview.add_paragraph("Workbook has no worksheets.")
+
+
+def process_excel(file_path, preview, settings=None):
+    """
+    Process an Excel file and add its content to the preview.
+    
+    First attempts to convert to PDF, falls back to direct data
+    extraction using openpyxl if conversion fails. When more than one sheet
+    is previewed (settings.excel_sheets), the data of each sheet of an OOXML
+    workbook is extracted directly and shown under its own subheading;
+    other workbooks are previewed as with a single sheet.
+    
+    Args:
+        file_path (str): Path to the Excel file
+        preview (FilePreview): Preview to record the content into
+        settings (RenderSettings, optional): Render settings. Defaults to RenderSettings().
+        
+    Returns:
+        None
+    """
+    settings = settings or RenderSettings()
+    try:
+        if settings.excel_sheets != 1 and is_ooxml_workbook(file_path):
+            # A converted page cannot be split by sheet
+            add_excel_sheets(file_path, preview, settings)
+            return
+        
+        # An embedded thumbnail needs no conversion at all
+        if add_embedded_thumbnail(file_path, preview, settings):
+            return
+        
+        # Convert Excel to PDF first, on a warm converter instance
+        converted = convert_and_process_pdf(file_path, 'excel', preview, settings)
+        
+        if not converted:
+            # Fallback to openpyxl method
+            try:
+                # Stream the rows instead of loading every cell of every sheet
+                with open_read_only_workbook(file_path) as wb:
+                    sheet = wb.active
+                    rows, cell_range = read_sheet_preview(sheet)
+                
+                if rows:
+                    preview.add_table(rows)
+                    preview.add_paragraph(f"Excel data extracted directly using openpyxl "
+                                          f"(sheet '{sheet.title}', cells {cell_range}).")
+                else:
+                    preview.add_paragraph(f"Excel sheet '{sheet.title}' appears to be empty.")
+                
+            except Exception as openpyxl_error:
+                print(f"Error processing Excel file: {str(openpyxl_error)}")
+                preview.failed = True
+                preview.add_paragraph(f"Failed to process Excel file: {str(openpyxl_error)}")
+                
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+        preview.add_paragraph(f"Error processing {file_path}: {str(e)}")
+
+
+# Display width of images in the report, in inches
+IMAGE_WIDTH_INCHES = 6.0
+
+# Image formats embedded as they are when no downscaling is needed
+EMBEDDABLE_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'BMP')
+
+# Image modes written to PNG previews as they are
+PNG_IMAGE_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA')
+
+# Grayscale modes with more than 8 bits per pixel
+HIGH_DEPTH_IMAGE_MODES = ('I', 'F', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+
+# EXIF tags locating the JPEG thumbnail in IFD1
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+
+
+def read_exif_thumbnail(img):
+    """
+    Read the thumbnail embedded in the EXIF data of a JPEG photo.
+    
+    Args:
+        img (Image): Opened (not yet decoded) JPEG image
+        
+    Returns:
+        Image: The decoded thumbnail, or None if the photo has none
+    """
+    exif_data = img.info.get('exif')
+    if not exif_data:
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1.get(EXIF_THUMBNAIL_OFFSET)
+        length = ifd1.get(EXIF_THUMBNAIL_LENGTH)
+        if not offset or not length:
+            return None
+        # Offsets are relative to the TIFF header following b'Exif\0\0'
+        thumbnail = Image.open(BytesIO(exif_data[6 + offset:6 + offset + length]))
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None
+
+
+def convert_for_png(image):
+    """
+    Convert an image to a mode that can be saved as an 8-bit PNG.
+    
+    CMYK, YCbCr, LAB and premultiplied images become RGB or RGBA. High bit
+    depth grayscale images are stretched over their range of values, which
+    clipping them to 8 bits would mostly turn white.
+    
+    Args:
+        image (Image): PIL image
+        
+    Returns:
+        Image: The image itself if its mode can be saved, else a converted copy
+    """
+    if image.mode in PNG_IMAGE_MODES:
+        return image
+    if image.mode in HIGH_DEPTH_IMAGE_MODES:
+        image = image.convert('F')
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 0
+        return image.point(lambda value: (value - low) * scale).convert('L')
+    return image.convert('RGBA' if image.mode in ('PA', 'RGBa', 'La') else 'RGB')
+
+
+def process_image(file_path, preview, settings=None):
+    """
+    Process an image file and add it to the preview.
+    
+    Images are embedded at IMAGE_WIDTH_INCHES wide, so larger ones are
+    downscaled to the pixel width needed at settings.image_dpi before being
+    re-encoded. JPEG photos are not fully decoded for that: their EXIF
+    thumbnail is used when it is large enough, otherwise they are decoded
+    in draft mode at a reduced scale. Images already small enough are
+    embedded as they are.
+    
+    Args:
+        file_path (str): Path to the image file
+        preview (FilePreview): Preview to record the image into
+        settings (RenderSettings, optional): Render settings (image_dpi,
+            jpeg_quality). Defaults to RenderSettings().
+        
+    Returns:
+        None
+    """
+    settings = settings or RenderSettings()
+    try:
+        # Opening only reads the header; pixels are decoded on demand
+        with Image.open(file_path) as img:
+            target_width = round(IMAGE_WIDTH_INCHES * settings.image_dpi)
+            width, height = img.size
+            image_format = img.format
+            
+            if width <= target_width and image_format in EMBEDDABLE_IMAGE_FORMATS:
+                # Small enough already: embed the file without re-encoding
+                with open(file_path, 'rb') as f:
+                    preview.add_picture(f.read(), width=IMAGE_WIDTH_INCHES)
+                return
+            
+            target_size = (min(target_width, width), max(1, round(height * min(target_width, width) / width)))
+            source = None
+            if image_format == 'JPEG':
+                thumbnail = read_exif_thumbnail(img)
+                if thumbnail is not None and thumbnail.width >= target_size[0]:
+                    source = thumbnail
+                else:
+                    # Let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+                    img.draft('RGB', target_size)
+            if source is None:
+                source = img
+            
+            resized = source.resize(target_size, Image.Resampling.LANCZOS) if source.size != target_size else source
+            
+            # Save to BytesIO to avoid file system operations
+            img_byte_arr = BytesIO()
+            if image_format == 'JPEG':
+                if resized.mode not in ('RGB', 'L'):
+                    resized = resized.convert('RGB')
+                resized.save(img_byte_arr, format='JPEG', quality=settings.jpeg_quality)
+            else:
+                # Keep transparency and sharp edges of non-photographic formats
+                convert_for_png(resized).save(img_byte_arr, format='PNG')
+        
+        # Add to preview with explicit float width
+        preview.add_picture(img_byte_arr.getvalue(), width=IMAGE_WIDTH_INCHES)
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+
+
+# Bytes read from the start of a text file; enough for the preview lines
+TEXT_PREVIEW_BYTES = 64 * 1024
+
+# Bytes handed to chardet when the sample is not valid UTF-8
+CHARDET_SAMPLE_BYTES = 16 * 1024
+
+# Share of code units with a zero high byte in UTF-16 text without a BOM
+UTF16_ZERO_RATIO = 0.6
+
+# Number of lines or CSV rows shown in a text preview
+TEXT_PREVIEW_LINES = 10
+
+# Size of the blocks read backwards from the end of a file in tail mode
+TAIL_BLOCK_BYTES = 8 * 1024
+
+# Byte order marks with the codec of the text after them and its code unit
+# size; UTF-32 first, its LE BOM starts with UTF-16's
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le', 4),
+    (codecs.BOM_UTF32_BE, 'utf-32-be', 4),
+    (codecs.BOM_UTF8, 'utf-8', 1),
+    (codecs.BOM_UTF16_LE, 'utf-16-le', 2),
+    (codecs.BOM_UTF16_BE, 'utf-16-be', 2),
+)
+
+# chardet results replaced by a superset codec, so that rarer characters in
+# the rest of the file still decode
+ENCODING_SUPERSETS = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'ascii': 'utf-8',
+}
+
+
+def find_bom(data):
+    """
+    Find the byte order mark at the start of a file.
+    
+    Args:
+        data (bytes): Leading bytes of the file
+        
+    Returns:
+        tuple: (BOM bytes, codec, code unit size) from BOMS, or None
+    """
+    for bom in BOMS:
+        if data.startswith(bom[0]):
+            return bom
+    return None
+
+
+def find_utf16_without_bom(data):
+    """
+    Recognize UTF-16 text without a byte order mark.
+    
+    Mostly Latin text has a zero high byte in most of its code units, which
+    lie at the odd offsets in little endian and at the even ones in big
+    endian text, while the other bytes are not zero.
+    
+    Args:
+        data (bytes): Leading bytes of the file
+        
+    Returns:
+        str: 'utf-16-le' or 'utf-16-be', or None
+    """
+    sample = data[:min(len(data), CHARDET_SAMPLE_BYTES) & ~1]
+    units = len(sample) // 2
+    if units < 2 or b'\x00' not in sample:
+        return None
+    even_zeros = sample[0::2].count(0)
+    odd_zeros = sample[1::2].count(0)
+    if odd_zeros >= units * UTF16_ZERO_RATIO and even_zeros <= units * 0.01:
+        return 'utf-16-le'
+    if even_zeros >= units * UTF16_ZERO_RATIO and odd_zeros <= units * 0.01:
+        return 'utf-16-be'
+    return None
+
+
+def detect_encoding(data):
+    """
+    Detect the encoding of a text sample without a byte order mark.
+    
+    Checks whether the sample is UTF-16 or valid UTF-8 and only then asks
+    chardet, on at most CHARDET_SAMPLE_BYTES.
+    
+    Args:
+        data (bytes): Bytes of the file (may end mid-character)
+        
+    Returns:
+        str: Codec name, or None if the sample does not look like text
+    """
+    encoding = find_utf16_without_bom(data)
+    if encoding is not None:
+        # Its zero bytes would also pass as UTF-8
+        return encoding
+    try:
+        # Incremental decoding tolerates a character cut at the end of the sample
+        codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    encoding = chardet.detect(data[:CHARDET_SAMPLE_BYTES])['encoding']
+    if encoding is None:
+        return None
+    encoding = encoding.lower()
+    return ENCODING_SUPERSETS.get(encoding, encoding)
+
+
+def read_text_preview(file_path):
+    """
+    Read and decode the start of a text file in a single bounded read.
+    
+    Args:
+        file_path (str): Path to the text file
+        
+    Returns:
+        tuple: (text, encoding) where text only holds complete lines unless
+            the whole file was read, or (None, None) if it is not text
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read(TEXT_PREVIEW_BYTES + 1)
+    complete = len(data) <= TEXT_PREVIEW_BYTES
+    data = data[:TEXT_PREVIEW_BYTES]
+    
+    bom = find_bom(data)
+    if bom is not None:
+        data = data[len(bom[0]):]
+        encoding = bom[1]
+    else:
+        encoding = detect_encoding(data)
+    if encoding is None:
+        return None, None
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(data, final=complete)
+    if not complete:
+        # Drop the line cut off by the end of the sample
+        last_newline = text.rfind('\n')
+        if last_newline >= 0:
+            text = text[:last_newline + 1]
+    return text, encoding
+
+
+def read_text_tail(file_path, lines=TEXT_PREVIEW_LINES):
+    """
+    Read and decode the last lines of a text file.
+    
+    Blocks are read backwards from the end of the file until enough line
+    breaks were seen or TEXT_PREVIEW_BYTES were read, so the cost does not
+    depend on the size of the file.
+    
+    Args:
+        file_path (str): Path to the text file
+        lines (int, optional): Number of lines to return. Defaults to
+            TEXT_PREVIEW_LINES.
+        
+    Returns:
+        tuple: (text, encoding) where text holds the last complete lines,
+            or (None, None) if it is not text
+    """
+    with open(file_path, 'rb') as f:
+        bom = find_bom(f.read(4))
+        marker, encoding, unit = bom if bom is not None else (b'', None, 1)
+        newline = '\n'.encode(encoding) if encoding else b'\n'
+        start = len(marker)
+        end = f.seek(0, os.SEEK_END)
+        # Keep reads aligned to the code units of UTF-16 and UTF-32
+        pos = end - (end - start) % unit
+        
+        blocks = []
+        size = newlines = 0
+        while pos > start and newlines <= lines and size < TEXT_PREVIEW_BYTES:
+            step = min(TAIL_BLOCK_BYTES, pos - start)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            blocks.append(block)
+            size += len(block)
+            newlines += block.count(newline)
+    
+    data = b''.join(reversed(blocks))
+    if pos > start and unit == 1:
+        # Resynchronize multi-byte encodings on a line break, dropping the
+        # line cut off by the start of the sample
+        data = data[data.find(b'\n') + 1:]
+    if encoding is None:
+        encoding = detect_encoding(data)
+        if encoding is None:
+            return None, None
+    tail = list(StringIO(data.decode(encoding, errors='replace'), newline=None))
+    if pos > start and unit > 1:
+        tail = tail[1:]
+    return ''.join(tail[-lines:]), encoding
+
+
+# Delimiters considered when sniffing CSV files
+CSV_DELIMITERS = ',;\t|'
+
+# Size of the chunks read by the streaming CSV passes
+CSV_CHUNK_BYTES = 1024 * 1024
+
+# Cell values counted as nulls by the CSV profile (compared lowercased)
+CSV_NULL_VALUES = frozenset(('', 'null', 'none', 'na', 'n/a', 'nan'))
+
+
+def sniff_csv_delimiter(sample):
+    """
+    Detect the delimiter of a CSV file from a sample of its text.
+    
+    Args:
+        sample (str): Leading text of the file
+        
+    Returns:
+        str: The delimiter, ',' if none of CSV_DELIMITERS fits
+    """
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+
+def count_lines(file_path, newline=b'\n'):
+    """
+    Count the line breaks of a file over its memory-mapped bytes.
+    
+    The file is scanned in CSV_CHUNK_BYTES windows, so it is never loaded
+    into memory and the count runs at disk speed.
+    
+    Args:
+        file_path (str): Path to the file
+        newline (bytes, optional): Encoded line break. Defaults to b'\\n'.
+        
+    Returns:
+        tuple: (number of line breaks, whether the file ends with one)
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0, True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count = 0
+            # Overlap the windows so that multi-byte line breaks are not split
+            overlap = len(newline) - 1
+            for start in range(0, size, CSV_CHUNK_BYTES):
+                count += mm[start:start + CSV_CHUNK_BYTES + overlap].count(newline)
+            return count, mm[size - len(newline):] == newline
+
+
+def profile_csv(file_path, encoding, delimiter, max_rows=0):
+    """
+    Compute column statistics of a CSV file in one streaming pass.
+    
+    The file is decoded and parsed in CSV_CHUNK_BYTES chunks. No rows are
+    kept in memory, only the running statistics of each column.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        encoding (str): Codec of the file, as returned by read_text_preview
+        delimiter (str): Field delimiter
+        max_rows (int, optional): Data rows to profile, 0 for all of them.
+            Defaults to 0.
+        
+    Returns:
+        dict: 'header' (list of column names), 'rows' (data rows profiled),
+            'complete' (whether all rows were profiled) and 'columns' (list
+            of dicts with 'nulls', 'min', 'max' and 'type', one of 'empty',
+            'integer', 'number' or 'text')
+    """
+    with open(file_path, 'rb', buffering=CSV_CHUNK_BYTES) as raw:
+        bom = find_bom(raw.read(4))
+        raw.seek(len(bom[0]) if bom is not None else 0)
+        f = io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline='')
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, [])
+        cols = len(header)
+        nulls = [0] * cols
+        mins = [None] * cols
+        maxs = [None] * cols
+        # 0: no values yet, 1: integer, 2: number, 3: text
+        types = [0] * cols
+        
+        rows = 0
+        complete = True
+        for row in reader:
+            if max_rows and rows >= max_rows:
+                complete = False
+                break
+            rows += 1
+            for i, value in enumerate(row[:cols]):
+                value = value.strip()
+                if value.lower() in CSV_NULL_VALUES:
+                    nulls[i] += 1
+                    continue
+                if types[i] == 3:
+                    continue
+                try:
+                    number = int(value)
+                    kind = 1
+                except ValueError:
+                    try:
+                        number = float(value)
+                        kind = 2
+                    except ValueError:
+                        types[i] = 3
+                        continue
+                types[i] = max(types[i], kind)
+                if mins[i] is None or number < mins[i]:
+                    mins[i] = number
+                if maxs[i] is None or number > maxs[i]:
+                    maxs[i] = number
+            # Short rows are missing trailing values
+            for i in range(len(row), cols):
+                nulls[i] += 1
+    
+    type_names = ('empty', 'integer', 'number', 'text')
+    return {
+        'header': header,
+        'rows': rows,
+        'complete': complete,
+        'columns': [{
+            'nulls': nulls[i],
+            'min': mins[i] if types[i] != 3 else None,
+            'max': maxs[i] if types[i] != 3 else None,
+            'type': type_names[types[i]],
+        } for i in range(cols)],
+    }
+
+
+def add_csv_profile(file_path, encoding, delimiter, preview, settings):
+    """
+    Record the profile of a CSV file: its size and per-column statistics.
+    
+    The row count comes from counting line breaks over the whole file; the
+    column statistics cover at most settings.csv_profile_rows rows.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        encoding (str): Codec of the file
+        delimiter (str): Field delimiter
+        preview (FilePreview): Preview to record the profile into
+        settings (RenderSettings): Render settings (csv_profile_rows)
+        
+    Returns:
+        None
+    """
+    profile = profile_csv(file_path, encoding, delimiter, settings.csv_profile_rows)
+    if profile['complete']:
+        # Exact even with line breaks inside quoted values
+        total_rows = profile['rows']
+    else:
+        newlines, ends_with_newline = count_lines(file_path, '\n'.encode(encoding))
+        total_rows = max(newlines + (0 if ends_with_newline else 1) - 1, 0)
+    
+    def format_number(number):
+        return '' if number is None else f"{number:.15g}" if isinstance(number, float) else str(number)
+    
+    rows = [['Column', 'Type', 'Nulls', 'Min', 'Max']]
+    for name, column in zip(profile['header'], profile['columns']):
+        rows.append([name, column['type'], str(column['nulls']),
+                     format_number(column['min']), format_number(column['max'])])
+    preview.add_paragraph(f"CSV profile: {total_rows} rows, {len(profile['header'])} columns, "
+                          f"delimiter {delimiter!r}")
+    preview.add_table(rows)
+    if not profile['complete']:
+        preview.add_paragraph(f"Column statistics computed over the first {profile['rows']} rows.")
+
+
+def process_text(file_path, preview, settings=None):
+    """
+    Process a text file and add its content to the preview.
+    
+    Handles various encodings and special formats like CSV. Only the start
+    of the file is read, once; its encoding is detected from that sample,
+    so Chinese text in GB18030 or Big5 is shown properly. Files with an
+    extension in settings.tail_extensions show their last lines instead.
+    
+    Args:
+        file_path (str): Path to the text file
+        preview (FilePreview): Preview to record the content into
+        settings (RenderSettings, optional): Render settings (tail_extensions).
+            Defaults to RenderSettings().
+        
+    Returns:
+        None
+    """
+    settings = settings or RenderSettings()
+    try:
+        # Check if this is a CSV file based on extension
+        extension = os.path.splitext(file_path)[1].lower()
+        is_csv = extension == '.csv'
+        tail = not is_csv and extension in settings.tail_extensions
+        
+        if tail:
+            text, encoding = read_text_tail(file_path)
+        else:
+            text, encoding = read_text_preview(file_path)
+        if text is None:
+            preview.add_paragraph(f"Could not detect the encoding of the file.")
+            print(f"Error processing {file_path}: Could not detect the encoding")
+            preview.failed = True
+            return
+        
+        if is_csv:
+            # For CSV files, create a table representation
+            delimiter = sniff_csv_delimiter(text)
+            reader = csv.reader(StringIO(text, newline=''), delimiter=delimiter)
+            rows = list(itertools.islice(reader, TEXT_PREVIEW_LINES))
+            
+            if rows:
+                # Create a table, never exceeding the header's column count
+                cols = len(rows[0])
+                preview.add_table([row[:cols] for row in rows])
+                        
+                preview.add_paragraph(f"CSV data presented as table (first {TEXT_PREVIEW_LINES} rows). "
+                                      f"Detected encoding: {encoding}")
+                if settings.csv_profile:
+                    add_csv_profile(file_path, encoding, delimiter, preview, settings)
+            else:
+                preview.add_paragraph("CSV file appears to be empty.")
+        elif tail:
+            # For logs, the end of the file is the interesting part
+            preview.add_paragraph(text)
+            preview.add_paragraph(f"Last {TEXT_PREVIEW_LINES} lines. Detected encoding: {encoding}")
+        else:
+            # For regular text files
+            content = ''.join(itertools.islice(StringIO(text, newline=None), TEXT_PREVIEW_LINES))
+            preview.add_paragraph(content)
+            preview.add_paragraph(f"Detected encoding: {encoding}")
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+        preview.add_paragraph(f"Error processing {file_path}: {str(e)}")
+
+
+def add_bookmark(paragraph, bookmark_name, bookmark_id=0):
+    """
+    Add a bookmark to a paragraph.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add bookmark to
+        bookmark_name (str): Name of the bookmark
+        bookmark_id (int, optional): Identifier of the bookmark, unique
+            within the document. Defaults to 0.
+        
+    Returns:
+        str: Name of the bookmark that was added
+    """
+    run = paragraph.add_run()
+    tag = run._r
+    start = OxmlElement('w:bookmarkStart')
+    start.set(qn('w:id'), str(bookmark_id))
+    start.set(qn('w:name'), bookmark_name)
+    tag.append(start)
+    
+    end = OxmlElement('w:bookmarkEnd')
+    end.set(qn('w:id'), str(bookmark_id))
+    tag.append(end)
+    
+    return bookmark_name
+
+
+# Longest bookmark name Word accepts
+BOOKMARK_NAME_LENGTH = 40
+# Characters left after file bookmark names for the subheading anchors
+# derived from them (e.g. '_sheet12')
+BOOKMARK_ANCHOR_RESERVE = 10
+# Hex digits of the path hash in file bookmark names
+BOOKMARK_HASH_DIGITS = 8
+INVALID_BOOKMARK_CHARS = re.compile(r'[^0-9A-Za-z_]')
+
+
+def get_valid_bookmark_name(file_path):
+    """
+    Convert a file path to a valid bookmark name.
+    
+    Characters Word does not accept in bookmark names are replaced with
+    underscores, and the name is shortened so that a subheading anchor
+    still fits in Word's 40 character limit. The name is not unique: files
+    with the same name in different directories share it; BookmarkRegistry
+    adds a hash of the path.
+    
+    Args:
+        file_path (str): File path to convert to bookmark name
+        
+    Returns:
+        str: Valid bookmark name
+    """
+    name = INVALID_BOOKMARK_CHARS.sub('_', os.path.basename(file_path))
+    length = BOOKMARK_NAME_LENGTH - BOOKMARK_ANCHOR_RESERVE - BOOKMARK_HASH_DIGITS - 1
+    return f"bm_{name}"[:length]
+
+
+class BookmarkRegistry:
+    """
+    Bookmarks of a report, with unique names and identifiers.
+    
+    Files get a name made of their file name and a short hash of their
+    path, so same-named files in different directories do not share a
+    bookmark; the rare hash collisions are resolved on registration.
+    Every bookmark placed in the document gets its own numeric identifier.
+    Lookups by file and by name are dictionary lookups.
+    """
+    
+    def __init__(self):
+        # Bookmark name of each registered key, in registration order
+        self._names = {}
+        # Object each file bookmark leads to, keyed by bookmark name
+        self._targets = {}
+        # Identifier of each bookmark placed in the document
+        self._ids = {}
+    
+    def register(self, key, label, target=None):
+        """
+        Get the bookmark name of a file, registering it on first use.
+        
+        Args:
+            key (str): Unique key of the file, e.g. its absolute path
+            label (str): Readable part of the name, e.g. the file name
+            target (object, optional): Object the bookmark leads to, listed
+                by targets
+            
+        Returns:
+            str: Bookmark name, at most BOOKMARK_NAME_LENGTH minus
+                BOOKMARK_ANCHOR_RESERVE characters
+        """
+        name = self._names.get(key)
+        if name is not None:
+            return name
+        
+        prefix = get_valid_bookmark_name(label)
+        salt = 0
+        while True:
+            data = key if not salt else f"{key}\0{salt}"
+            digest = hashlib.sha1(data.encode('utf-8', 'surrogatepass')).hexdigest()
+            name = f"{prefix}_{digest[:BOOKMARK_HASH_DIGITS]}"
+            if name not in self._targets:
+                break
+            salt += 1
+        self._names[key] = name
+        self._targets[name] = target
+        return name
+    
+    def get(self, key):
+        """
+        Get the bookmark name of a registered file.
+        
+        Args:
+            key (str): Key the file was registered with
+            
+        Returns:
+            str: Bookmark name, or None if the file is not registered
+        """
+        return self._names.get(key)
+    
+    def bookmark_id(self, name):
+        """
+        Get the identifier of a bookmark, assigning the next free one on
+        first use.
+        
+        Args:
+            name (str): Bookmark name
+            
+        Returns:
+            int: Identifier for the w:id attributes of the bookmark
+        """
+        bookmark_id = self._ids.get(name)
+        if bookmark_id is None:
+            bookmark_id = self._ids[name] = len(self._ids)
+        return bookmark_id
+    
+    def targets(self):
+        """
+        List the registered files in registration order.
+        
+        Returns:
+            iterator: (bookmark name, target) tuples
+        """
+        return iter(self._targets.items())
+    
+    def __len__(self):
+        return len(self._names)
+
+
+def add_internal_hyperlink(paragraph, anchor_text, bookmark_name, tooltip=None):
+    """
+    Add an internal hyperlink to a paragraph.
+    
+    Creates a clickable link to navigate within the document.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add hyperlink to
+        anchor_text (str): Text to display as the hyperlink
+        bookmark_name (str): Name of the bookmark to link to
+        tooltip (str, optional): Tooltip text for the hyperlink
+        
+    Returns:
+        None
+    """
+    hyperlink = OxmlElement('w:hyperlink')
+    hyperlink.set(qn('w:anchor'), bookmark_name)
+    
+    if tooltip:
+        hyperlink.set(qn('w:tooltip'), tooltip)
+    
+    new_run = OxmlElement('w:r')
+    hyperlink.append(new_run)
+    
+    rPr = OxmlElement('w:rPr')
+    new_run.append(rPr)
+    
+    rStyle = OxmlElement('w:rStyle')
+    rStyle.set(qn('w:val'), 'Hyperlink')
+    rPr.append(rStyle)
+    
+    t = OxmlElement('w:t')
+    t.text = anchor_text
+    new_run.append(t)
+    
+    paragraph._p.append(hyperlink)
+
+
+def add_hyperlink(paragraph, text, url):
+    """
+    Add an external hyperlink to a paragraph.
+    
+    Creates a clickable link to an external resource.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add hyperlink to
+        text (str): Text to display as the hyperlink
+        url (str): URL to link to
+        
+    Returns:
+        None
+    """
+    # Add a hyperlink to a paragraph
+    part = paragraph.part
+    r_id = part.relate_to(url, docx.opc.constants.RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
+    
+    hyperlink = OxmlElement('w:hyperlink')
+    hyperlink.set(qn('r:id'), r_id)
+    
+    new_run = OxmlElement('w:r')
+    hyperlink.append(new_run)
+    
+    rPr = OxmlElement('w:rPr')
+    new_run.append(rPr)
+    
+    rStyle = OxmlElement('w:rStyle')
+    rStyle.set(qn('w:val'), 'Hyperlink')
+    rPr.append(rStyle)
+    
+    t = OxmlElement('w:t')
+    t.text = text
+    new_run.append(t)
+    
+    paragraph._p.append(hyperlink)
+
+
+def add_toc_field_start(paragraph):
+    """
+    Start a table of contents field in a paragraph.
+    
+    Everything added after this, up to add_toc_field_end, is the field's
+    current result, shown until Word updates the document's fields.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add the field start to
+        
+    Returns:
+        None
+    """
+    run = paragraph.add_run()
+    
+    # Add TOC field with improved formatting
+    fldChar = OxmlElement('w:fldChar')
+    fldChar.set(qn('w:fldCharType'), 'begin')
+    
+    # Enhanced TOC instruction text for better formatting
+    instrText = OxmlElement('w:instrText')
+    instrText.set(qn('xml:space'), 'preserve')
+    instrText.text = 'TOC \\o "1-3" \\h \\z \\u \\w'
+    
+    # Add separator
+    fldChar2 = OxmlElement('w:fldChar')
+    fldChar2.set(qn('w:fldCharType'), 'separate')
+    
+    # Assemble TOC field
+    r_element = run._r
+    r_element.append(fldChar)
+    r_element.append(instrText)
+    r_element.append(fldChar2)
+
+
+def add_toc_field_end(paragraph):
+    """
+    End a table of contents field started with add_toc_field_start.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add the field end to
+        
+    Returns:
+        None
+    """
+    fldChar = OxmlElement('w:fldChar')
+    fldChar.set(qn('w:fldCharType'), 'end')
+    paragraph.add_run()._r.append(fldChar)
+
+
+def add_toc_field(paragraph):
+    """
+    Add an empty table of contents field to a paragraph.
+    
+    The field is empty until Word updates the document's fields.
+    
+    Args:
+        paragraph (Paragraph): Paragraph object to add the field to
+        
+    Returns:
+        None
+    """
+    add_toc_field_start(paragraph)
+    add_toc_field_end(paragraph)
+
+
+def add_index_entry(paragraph, filename, bookmark_name, path_context, rel_location):
+    """
+    Fill a File Index paragraph with a link to a file's section.
+    
+    Args:
+        paragraph (Paragraph): Empty paragraph object for the entry
+        filename (str): File name, shown as the link text
+        bookmark_name (str): Bookmark of the file's section
+        path_context (str): Path context shown after the link
+        rel_location (str): Directory of the file relative to the input directory
+        
+    Returns:
+        None
+    """
+    # Format the entry with file name and path context with internal link
+    add_internal_hyperlink(paragraph, filename, bookmark_name, f"Go to {filename}")
+    paragraph.add_run(f" ({os.path.splitext(filename)[1]}) - {path_context}")
+    
+    # Add the relative directory path on a new line with indentation
+    paragraph.add_run("\n    Location: " + rel_location)
+
+
+# Characters that are not allowed in XML 1.0 documents
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# Markup of a File Index entry, rendering like the paragraphs of add_index_entry
+INDEX_ENTRY_XML = (
+    '<w:p><w:hyperlink w:anchor="{0}" w:tooltip="Go to {1}"><w:r><w:rPr>'
+    '<w:rStyle w:val="Hyperlink"/></w:rPr><w:t>{1}</w:t></w:r></w:hyperlink>'
+    '<w:r><w:t xml:space="preserve"> ({2}) - {3}</w:t><w:br/>'
+    '<w:t xml:space="preserve">    Location: {4}</w:t></w:r></w:p>'
+)
+
+
+def escape_xml(text):
+    """
+    Escape text for XML element content and double-quoted attributes.
+    
+    Args:
+        text (str): Text to escape
+        
+    Returns:
+        str: Escaped text
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+# File Index entries serialized and appended together
+INDEX_CHUNK_ENTRIES = 10000
+
+# Orders of the File Index entries: sort key of a FileEntry, None for walk order
+INDEX_SORT_KEYS = {
+    'walk': None,
+    'name': lambda entry: (entry.name.lower(), entry.rel_dir.lower()),
+    'path': lambda entry: (entry.rel_dir.lower(), entry.name.lower()),
+    'type': lambda entry: (entry.ext, entry.name.lower()),
+}
+
+# Headings of the File Index groups by file type
+INDEX_KIND_TITLES = {
+    'pdf': 'PDF files',
+    'word': 'Word documents',
+    'excel': 'Excel workbooks',
+    'image': 'Images',
+    'text': 'Text files',
+}
+
+
+def build_index_xml(entries):
+    """
+    Build the XML of consecutive File Index entries in one pass.
+    
+    Args:
+        entries (iterable): (filename, bookmark name, path context, relative
+            location) tuples, as taken by add_index_entry
+        
+    Returns:
+        str: w:p elements without namespace declarations
+    """
+    fields = []
+    for filename, bookmark_name, path_context, rel_location in entries:
+        fields += (bookmark_name, filename, os.path.splitext(filename)[1], path_context, rel_location)
+    # Escape all fields in one pass, NUL separated since NUL cannot appear in
+    # file names or paths; other strings may contain it and are escaped one by one
+    values = escape_xml('\0'.join(fields)).split('\0')
+    if len(values) != len(fields):
+        values = [escape_xml(value.replace('\0', '')) for value in fields]
+    
+    xml = ''.join([INDEX_ENTRY_XML.format(*entry_values) for entry_values in zip(*[iter(values)] * 5)])
+    # Characters not allowed in XML cannot come from the template, so they
+    # are removed from the whole fragment at once
+    return INVALID_XML_CHARS.sub('', xml)
+
+
+def group_index_entries(targets, sort='walk', group_by=None):
+    """
+    Order the File Index entries and split them into groups.
+    
+    Args:
+        targets (iterable): (bookmark name, FileEntry) tuples in walk order,
+            as listed by BookmarkRegistry.targets
+        sort (str, optional): Key of INDEX_SORT_KEYS. Defaults to 'walk'.
+        group_by (str, optional): 'dir' to group the entries by directory,
+            'type' by file type, None for a single group. Defaults to None.
+        
+    Returns:
+        list: (group title or None, list of (bookmark name, FileEntry)) tuples
+    """
+    targets = list(targets)
+    sort_key = INDEX_SORT_KEYS[sort]
+    if sort_key is not None:
+        targets.sort(key=lambda target: sort_key(target[1]))
+    if group_by is None:
+        return [(None, targets)]
+    
+    groups = {}
+    for target in targets:
+        entry = target[1]
+        groups.setdefault(entry.rel_dir if group_by == 'dir' else entry.kind, []).append(target)
+    if group_by == 'dir':
+        return [(f"Location: {rel_dir}", groups[rel_dir]) for rel_dir in sorted(groups, key=str.lower)]
+    return [(INDEX_KIND_TITLES[kind], groups[kind]) for kind, _ in FILE_TYPES if kind in groups]
+
+# Splits cell text into runs of plain text, tabs and line breaks
+RUN_CONTENT_PARTS = re.compile(r'(\t|\r\n|\r|\n)')
+
+
+def build_cell_xml(text, col_width):
+    """
+    Build the XML of a single table cell.
+    
+    Tabs and line breaks become w:tab and w:br elements, like python-docx
+    does when setting cell text.
+    
+    Args:
+        text (str): Cell text
+        col_width (int): Column width in twips
+        
+    Returns:
+        str: w:tc element XML
+    """
+    tc_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{col_width}"/></w:tcPr>'
+    text = INVALID_XML_CHARS.sub('', text)
+    if not text:
+        return f'<w:tc>{tc_pr}<w:p/></w:tc>'
+    
+    parts = []
+    for part in RUN_CONTENT_PARTS.split(text):
+        if not part:
+            continue
+        if part == '\t':
+            parts.append('<w:tab/>')
+        elif part in ('\r\n', '\r', '\n'):
+            parts.append('<w:br/>')
+        elif part.strip() != part:
+            parts.append(f'<w:t xml:space="preserve">{escape(part)}</w:t>')
+        else:
+            parts.append(f'<w:t>{escape(part)}</w:t>')
+    return f'<w:tc>{tc_pr}<w:p><w:r>{"".join(parts)}</w:r></w:p></w:tc>'
+
+
+def build_table_xml(rows, style_id, width):
+    """
+    Build the XML of a whole table in one pass.
+    
+    Filling a python-docx table cell by cell rebuilds the cell grid on every
+    access, which makes large tables quadratic. This emits the same w:tbl
+    markup as python-docx's new_tbl followed by setting each cell's text, in
+    time linear in the number of cells.
+    
+    Args:
+        rows (list): List of rows, each a list of cell strings. Short rows
+            are padded with empty cells.
+        style_id (str): Table style id, e.g. 'TableGrid'
+        width (int): Table width in EMU, distributed evenly between columns
+        
+    Returns:
+        str: w:tbl element XML declaring the w namespace
+    """
+    cols = max((len(row) for row in rows), default=0)
+    col_width = Emu(width // cols).twips if cols else 0
+    
+    parts = [
+        f'<w:tbl {nsdecls("w")}><w:tblPr><w:tblStyle w:val="{escape(style_id)}"/>'
+        '<w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr><w:tblGrid>',
+        f'<w:gridCol w:w="{col_width}"/>' * cols,
+        '</w:tblGrid>',
+    ]
+    empty_cell = build_cell_xml('', col_width)
+    for row in rows:
+        parts.append('<w:tr>')
+        parts.extend(build_cell_xml(cell_value, col_width) for cell_value in row)
+        parts.append(empty_cell * (cols - len(row)))
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+
+def get_block_width(doc):
+    """
+    Get the usable width between the page margins of a document.
+    
+    Args:
+        doc (Document): Word document object
+        
+    Returns:
+        int: Width in EMU
+    """
+    section = doc.sections[0]
+    return section.page_width - section.left_margin - section.right_margin
+
+
+# Heading levels listed in the table of contents (matches the TOC field's \\o "1-3")
+TOC_LEVELS = 3
+
+
+def style_report_document(doc):
+    """
+    Apply the report's style tweaks to a new Word document.
+    
+    Args:
+        doc (Document): Word document object
+        
+    Returns:
+        None
+    """
+    heading_style = doc.styles['Heading 1']
+    heading_style.font.size = Pt(16)
+    heading_style.font.bold = True
+    
+    # Word's built-in TOC entry styles, used by the generated table of contents
+    for level in range(1, TOC_LEVELS + 1):
+        toc_style = doc.styles.add_style(f'toc {level}', WD_STYLE_TYPE.PARAGRAPH)
+        toc_style.style_id = f'TOC{level}'
+        toc_style.base_style = doc.styles['Normal']
+        toc_style.priority = 39
+        toc_style.unhide_when_used = True
+        toc_style.paragraph_format.left_indent = Pt(11 * (level - 1))
+        toc_style.paragraph_format.space_after = Pt(5)
+
+
+class BaseReportWriter:
+    """
+    Element building shared by the .docx report writers.
+    
+    Headings, paragraphs, tables and pictures are built directly as body
+    elements with cached style ids, without going through python-docx's
+    document API. Subclasses decide where finished elements go (_append and
+    _append_xml) and how image data is stored (_store_image).
+    """
+    
+    def __init__(self, doc):
+        """
+        Args:
+            doc (Document): Word document supplying styles and page layout
+        """
+        style_report_document(doc)
+        self._styles = doc.styles
+        self._style_ids = {}
+        self._table_style_id = self._styles['Table Grid'].style_id
+        self._block_width = get_block_width(doc)
+        self._image_rids = {}
+        self._image_count = 0
+        self._shape_id = 0
+        # (level, text, bookmark name) of every bookmarked heading, in order
+        self._toc_entries = []
+        self.bookmarks = BookmarkRegistry()
+    
+    def _style_id(self, style_name):
+        style_id = self._style_ids.get(style_name)
+        if style_id is None:
+            style_id = self._style_ids[style_name] = self._styles[style_name].style_id
+        return style_id
+    
+    def _new_paragraph(self, style_name=None):
+        p = OxmlElement('w:p')
+        if style_name:
+            p.style = self._style_id(style_name)
+        return Paragraph(p, None)
+    
+    def _append(self, element):
+        raise NotImplementedError
+    
+    def _append_xml(self, xml):
+        raise NotImplementedError
+    
+    def _append_xml_elements(self, xml):
+        raise NotImplementedError
+    
+    def _store_image(self, image, image_data, number):
+        raise NotImplementedError
+    
+    def _build_toc(self):
+        """
+        Build the table of contents paragraphs from the recorded headings.
+        
+        The entries are the TOC field's result, with a hyperlink to each
+        heading's bookmark, so the table of contents works without Word
+        updating the fields. Page numbers are only added by such an update.
+        
+        Returns:
+            list: w:p elements
+        """
+        if not self._toc_entries:
+            paragraph = self._new_paragraph()
+            add_toc_field(paragraph)
+            return [paragraph._p]
+        
+        paragraphs = []
+        for level, text, bookmark_name in self._toc_entries:
+            paragraph = self._new_paragraph(f'toc {level}')
+            if not paragraphs:
+                add_toc_field_start(paragraph)
+            add_internal_hyperlink(paragraph, text, bookmark_name)
+            paragraphs.append(paragraph)
+        add_toc_field_end(paragraphs[-1])
+        return [paragraph._p for paragraph in paragraphs]
+    
+    def add_heading(self, text, level, bookmark_name=None):
+        """
+        Add a heading, optionally carrying a bookmark.
+        
+        Args:
+            text (str): Heading text
+            level (int): Heading level, 0 for the title
+            bookmark_name (str, optional): Bookmark to place on the heading
+            
+        Returns:
+            None
+        """
+        paragraph = self._new_paragraph('Title' if level == 0 else f'Heading {level}')
+        # Control characters (form feeds, ANSI escapes, ...) cannot be stored in XML
+        text = INVALID_XML_CHARS.sub('', text)
+        paragraph.add_run(text)
+        if bookmark_name:
+            add_bookmark(paragraph, bookmark_name, self.bookmarks.bookmark_id(bookmark_name))
+            if 1 <= level <= TOC_LEVELS:
+                self._toc_entries.append((level, text, bookmark_name))
+        self._append(paragraph._p)
+    
+    def add_paragraph(self, text=''):
+        """
+        Add a paragraph of plain text.
+        
+        Args:
+            text (str, optional): Paragraph text
+            
+        Returns:
+            None
+        """
+        paragraph = self._new_paragraph()
+        text = INVALID_XML_CHARS.sub('', text)
+        if text:
+            paragraph.add_run(text)
+        self._append(paragraph._p)
+    
+    def add_picture(self, image_data, width):
+        """
+        Add an image in its own paragraph.
+        
+        Identical images are stored once.
+        
+        Args:
+            image_data (bytes): Encoded image data
+            width (float): Display width in inches
+            
+        Returns:
+            None
+        """
+        image = DocxImage.from_blob(image_data)
+        rId = self._image_rids.get(image.sha1)
+        if rId is None:
+            self._image_count += 1
+            rId = self._image_rids[image.sha1] = self._store_image(image, image_data, self._image_count)
+        
+        cx, cy = image.scaled_dimensions(Inches(width), None)
+        self._shape_id += 1
+        inline = CT_Inline.new_pic_inline(self._shape_id, rId, image.filename, cx, cy)
+        p = OxmlElement('w:p')
+        p.add_r().add_drawing(inline)
+        self._append(p)
+    
+    def add_table(self, rows):
+        """
+        Add a grid table.
+        
+        Args:
+            rows (list): List of rows, each a list of cell strings
+            
+        Returns:
+            None
+        """
+        self._append_xml(build_table_xml(rows, self._table_style_id, self._block_width))
+    
+    def add_pdf_page(self, pdf_data, width):
+        """
+        Add a PDF page; .docx reports show it rasterized.
+        
+        Args:
+            pdf_data (bytes): PDF document holding the page as its only page
+            width (float): Display width in inches
+            
+        Returns:
+            None
+        """
+        with fitz.open('pdf', pdf_data) as pdf:
+            self.add_picture(render_pdf_page(pdf[0], RenderSettings()), width)
+    
+    def add_page_break(self):
+        """
+        Add a page break.
+        
+        Returns:
+            None
+        """
+        paragraph = self._new_paragraph()
+        paragraph.add_run().add_break(WD_BREAK.PAGE)
+        self._append(paragraph._p)
+    
+    def add_toc(self):
+        """
+        Reserve the place of the table of contents.
+        
+        The entries are filled in when the report is saved, from all
+        bookmarked headings added by then.
+        
+        Returns:
+            None
+        """
+        raise NotImplementedError
+    
+    def add_index_entry(self, filename, bookmark_name, path_context, rel_location):
+        """
+        Add a File Index entry; see add_index_entry for the arguments.
+        
+        Returns:
+            None
+        """
+        paragraph = self._new_paragraph()
+        add_index_entry(paragraph, filename, bookmark_name, path_context, rel_location)
+        self._append(paragraph._p)
+    
+    def add_index_entries(self, entries):
+        """
+        Add File Index entries in bulk.
+        
+        The entries are serialized from a template and appended in chunks
+        instead of being built element by element.
+        
+        Args:
+            entries (iterable): (filename, bookmark name, path context,
+                relative location) tuples, as taken by add_index_entry
+            
+        Returns:
+            None
+        """
+        entries = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries, INDEX_CHUNK_ENTRIES))
+            if not chunk:
+                break
+            self._append_xml_elements(build_index_xml(chunk))
+
+
+class DocxReportWriter(BaseReportWriter):
+    """
+    Report sink that builds the whole report as a python-docx Document in memory.
+    
+    Body elements are inserted straight before the section properties held
+    in a direct handle, and images are registered through dictionaries, so
+    every append takes constant time however large the report grows.
+    python-docx's own add_* methods search the body and the image parts on
+    each call.
+    """
+    
+    def __init__(self):
+        self.doc = Document()
+        super().__init__(self.doc)
+        self._part = self.doc.part
+        self._sectPr = self.doc.element.body.get_or_add_sectPr()
+        self._toc_placeholder = None
+    
+    def _append(self, element):
+        self._sectPr.addprevious(element)
+    
+    def add_toc(self):
+        """
+        Reserve the place of the table of contents.
+        
+        The entries are filled in when the report is saved, from all
+        bookmarked headings added by then.
+        
+        Returns:
+            None
+        """
+        self._toc_placeholder = OxmlElement('w:p')
+        self._append(self._toc_placeholder)
+    
+    def _append_xml(self, xml):
+        self._sectPr.addprevious(parse_xml(xml))
+    
+    def _append_xml_elements(self, xml):
+        container = parse_xml(f'<w:body {nsdecls("w")}>{xml}</w:body>'.encode('utf-8'))
+        for element in list(container):
+            self._sectPr.addprevious(element)
+    
+    def _store_image(self, image, image_data, number):
+        partname = PackURI(f'/word/media/image{number}.{image.ext}')
+        image_part = ImagePart.from_image(image, partname)
+        self._part.package.image_parts.append(image_part)
+        rId = f"rIdImg{number}"
+        self._part.rels.add_relationship(RT.IMAGE, image_part, rId)
+        return rId
+    
+    def save(self, path):
+        """
+        Save the report.
+        
+        Args:
+            path (str): Output path
+            
+        Returns:
+            None
+        """
+        if self._toc_placeholder is not None:
+            for p in self._build_toc():
+                self._toc_placeholder.addprevious(p)
+            self._toc_placeholder.getparent().remove(self._toc_placeholder)
+            self._toc_placeholder = None
+        self.doc.save(path)
+    
+    def close(self):
+        """
+        Release resources held by the writer.
+        
+        Returns:
+            None
+        """
+        self.doc = None
+        self._part = None
+        self._sectPr = None
+        self._toc_placeholder = None
+
+
+class StreamingDocxWriter(BaseReportWriter):
+    """
+    Report sink that writes the .docx package incrementally.
+    
+    Images go into word/media/ of a spooled zip as soon as they are added, and
+    body XML is appended to a spool file, so memory stays bounded by a single
+    file's preview instead of growing with the whole report. The package parts
+    other than the body (styles, settings, theme, ...) come from python-docx's
+    default template, so the result matches what DocxReportWriter produces.
+    """
+    
+    IMAGE_CONTENT_TYPES = {
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'gif': 'image/gif',
+        'bmp': 'image/bmp',
+        'tiff': 'image/tiff',
+    }
+    
+    def __init__(self, spool_dir=None):
+        """
+        Args:
+            spool_dir (str, optional): Directory for the spool files, ideally
+                on the same disk as the output. Defaults to the system temp dir.
+        """
+        skeleton = Document()
+        super().__init__(skeleton)
+        skeleton_buffer = BytesIO()
+        skeleton.save(skeleton_buffer)
+        
+        try:
+            self._spool = tempfile.TemporaryFile(dir=spool_dir)
+            self._body = tempfile.TemporaryFile(dir=spool_dir)
+        except OSError:
+            self._spool = tempfile.TemporaryFile()
+            self._body = tempfile.TemporaryFile()
+        self._zip = zipfile.ZipFile(self._spool, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        
+        with zipfile.ZipFile(skeleton_buffer) as skeleton_zip:
+            for name in skeleton_zip.namelist():
+                data = skeleton_zip.read(name)
+                if name == 'word/document.xml':
+                    body_start = data.index(b'<w:body>') + len(b'<w:body>')
+                    self._document_head = data[:body_start]
+                    self._document_tail = data[data.index(b'<w:sectPr'):]
+                elif name == 'word/_rels/document.xml.rels':
+                    self._rels = data
+                else:
+                    if name == '[Content_Types].xml':
+                        data = self._add_image_content_types(data)
+                    self._zip.writestr(name, data)
+        
+        # Namespace declarations already made on the document root, stripped
+        # from each serialized fragment to keep the body compact
+        self._redundant_xmlns = [
+            f' xmlns:{prefix}="{uri}"'.encode('utf-8')
+            for prefix, uri in etree.fromstring(self._document_head + b'</w:body></w:document>').nsmap.items()
+        ]
+        self._image_rels = []
+        self._toc_offset = None
+    
+    def _add_image_content_types(self, data):
+        types = etree.fromstring(data)
+        namespace = types.nsmap[None]
+        declared = {element.get('Extension') for element in types}
+        for extension, content_type in self.IMAGE_CONTENT_TYPES.items():
+            if extension not in declared:
+                default = etree.SubElement(types, f'{{{namespace}}}Default')
+                default.set('Extension', extension)
+                default.set('ContentType', content_type)
+        return etree.tostring(types, xml_declaration=True, encoding='UTF-8', standalone=True)
+    
+    def _append(self, element):
+        self._append_xml(etree.tostring(element, encoding='utf-8'))
+    
+    def _append_xml(self, xml):
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        for declaration in self._redundant_xmlns:
+            xml = xml.replace(declaration, b'')
+        self._body.write(xml)
+    
+    def _append_xml_elements(self, xml):
+        # The elements rely on the namespace declarations of the document root
+        self._body.write(xml.encode('utf-8'))
+    
+    def add_toc(self):
+        """
+        Reserve the place of the table of contents.
+        
+        The entries are filled in when the report is saved, from all
+        bookmarked headings added by then.
+        
+        Returns:
+            None
+        """
+        self._toc_offset = self._body.tell()
+    
+    def _store_image(self, image, image_data, number):
+        # Write the image into word/media/ right away so it is not kept in memory
+        rId = f"rIdImg{number}"
+        target = f"media/image{number}.{image.ext}"
+        # JPEG data does not shrink any further, PNG renders of pages do
+        compress_type = zipfile.ZIP_STORED if image.ext == 'jpg' else zipfile.ZIP_DEFLATED
+        self._zip.writestr(f"word/{target}", image_data, compress_type=compress_type)
+        self._image_rels.append((rId, target))
+        return rId
+    
+    def _finish(self):
+        if self._zip is None:
+            return
+        
+        rels = etree.fromstring(self._rels)
+        namespace = rels.nsmap[None]
+        for rId, target in self._image_rels:
+            relationship = etree.SubElement(rels, f'{{{namespace}}}Relationship')
+            relationship.set('Id', rId)
+            relationship.set('Type', RT.IMAGE)
+            relationship.set('Target', target)
+        self._zip.writestr('word/_rels/document.xml.rels',
+                           etree.tostring(rels, xml_declaration=True, encoding='UTF-8', standalone=True))
+        
+        with self._zip.open('word/document.xml', 'w', force_zip64=True) as document_xml:
+            document_xml.write(self._document_head)
+            self._body.seek(0)
+            if self._toc_offset is not None:
+                # Copy the body up to the reserved place, then the TOC
+                remaining = self._toc_offset
+                while remaining:
+                    chunk = self._body.read(min(remaining, 1024 * 1024))
+                    document_xml.write(chunk)
+                    remaining -= len(chunk)
+                for p in self._build_toc():
+                    xml = etree.tostring(p, encoding='utf-8')
+                    for declaration in self._redundant_xmlns:
+                        xml = xml.replace(declaration, b'')
+                    document_xml.write(xml)
+            shutil.copyfileobj(self._body, document_xml)
+            document_xml.write(self._document_tail)
+        
+        self._zip.close()
+        self._zip = None
+        self._body.close()
+    
+    def save(self, path):
+        """
+        Finish the package and copy it to the output path.
+        
+        Can be called again with another path if saving fails.
+        
+        Args:
+            path (str): Output path
+            
+        Returns:
+            None
+        """
+        self._finish()
+        self._spool.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self._spool, f)
+    
+    def close(self):
+        """
+        Remove the spool files.
+        
+        Returns:
+            None
+        """
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+            self._body.close()
+        self._spool.close()
+
+
+class PdfReportWriter:
+    """
+    Report sink that lays the report out as a PDF with PyMuPDF.
+    
+    It takes the same calls as the .docx writers. Text is set on each page
+    through a single TextWriter, PDF pages recorded by the previews are
+    placed as vector content, and the table of contents and File Index
+    entries become PDF links. Headings are also listed in the PDF outline.
+    Headings, with a short paragraph right after them, are held back until
+    the block that follows is known, so that they start a new page with it
+    rather than end a page without it.
+    """
+    
+    PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size('a4')
+    MARGIN = 72
+    # Font size and space before of the headings by level
+    HEADING_STYLES = {0: (20, 0), 1: (16, 14), 2: (13, 12), 3: (11, 8)}
+    TEXT_SIZE = 10
+    TABLE_TEXT_SIZE = 8
+    LINE_HEIGHT = 1.3
+    PARAGRAPH_SPACING = 6
+    CELL_PADDING = 2
+    LINK_COLOR = (0.02, 0.39, 0.76)
+    # Longest paragraph kept on the page of the heading before it, in lines
+    KEPT_PARAGRAPH_LINES = 3
+    
+    def __init__(self):
+        self.doc = fitz.open()
+        self.bookmarks = BookmarkRegistry()
+        self._fonts = {False: fitz.Font('helv'), True: fitz.Font('hebo')}
+        # Covers the scripts Helvetica does not, e.g. Chinese and Japanese
+        self._fallback_font = fitz.Font('cjk')
+        # Glyph advance of each character per font, measuring text through
+        # Font.text_length costs a library call per character
+        self._advances = {font: {} for font in (*self._fonts.values(), self._fallback_font)}
+        self._uses_fallback_font = False
+        self._width = self.PAGE_WIDTH - 2 * self.MARGIN
+        self._bottom = self.PAGE_HEIGHT - self.MARGIN
+        self._page = None
+        self._text = None
+        self._link_text = None
+        self._shape = None
+        self._y = self._bottom
+        # (height, write) of the headings, and the paragraph after them,
+        # waiting for the block that follows
+        self._kept = []
+        self._kept_paragraph = False
+        # (page number, y) of each bookmark
+        self._destinations = {}
+        # (level, text, bookmark name) of every bookmarked heading, in order
+        self._toc_entries = []
+        # (page number, y) where the table of contents goes
+        self._toc_position = None
+        # (page number, link rectangle, bookmark name) of every internal link
+        self._links = []
+        # PDF object number of each image, keyed by its digest
+        self._image_xrefs = {}
+        self._finished = False
+    
+    def _new_page(self):
+        self._flush()
+        self._page = self.doc.new_page(width=self.PAGE_WIDTH, height=self.PAGE_HEIGHT)
+        self._text = fitz.TextWriter(self._page.rect)
+        self._link_text = fitz.TextWriter(self._page.rect, color=self.LINK_COLOR)
+        self._shape = self._page.new_shape()
+        self._y = self.MARGIN
+    
+    def _flush(self):
+        # Text and table borders are written once per page
+        if self._text is not None:
+            self._text.write_text(self._page)
+            self._link_text.write_text(self._page)
+            self._shape.finish(color=(0, 0, 0), width=0.5)
+            self._shape.commit()
+            self._text = self._link_text = self._shape = None
+    
+    def _reserve(self, height):
+        """
+        Start a new page unless height points fit below the current position.
+        
+        Returns:
+            float: Top of the reserved space
+        """
+        if self._page is None or self._y + height > self._bottom:
+            self._new_page()
+        top = self._y
+        self._y += height
+        return top
+    
+    def _keep(self, height, write):
+        """
+        Hold back a heading or a paragraph until the next block is known.
+        
+        Args:
+            height (float): Height it takes
+            write (callable): Writes it at the current position
+        """
+        self._kept.append((height, write))
+    
+    def _release(self, next_height=0):
+        """
+        Write the held back blocks, on a new page unless they fit on this
+        one together with next_height points of the block that follows.
+        """
+        if not self._kept:
+            return
+        kept, self._kept = self._kept, []
+        self._kept_paragraph = False
+        height = sum(kept_height for kept_height, _ in kept)
+        if self._page is None or (self._y + height + next_height > self._bottom and self._y > self.MARGIN):
+            self._new_page()
+        for _, write in kept:
+            write()
+    
+    def _font(self, text, bold=False):
+        font = self._fonts[bold]
+        if text.isascii() or all(font.has_glyph(ord(char)) for char in text):
+            return font
+        self._uses_fallback_font = True
+        return self._fallback_font
+    
+    def _text_length(self, text, font, size):
+        advances = self._advances[font]
+        length = 0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = advances[char] = font.glyph_advance(ord(char))
+            length += advance
+        return length * size
+    
+    def _wrap(self, text, font, size, width):
+        """
+        Break text into lines fitting a width.
+        
+        Returns:
+            list: Lines of text
+        """
+        lines = []
+        for paragraph in text.replace('\t', '    ').splitlines() or ['']:
+            line = ''
+            for word in re.split(r'(?<=\s)', paragraph):
+                candidate = line + word
+                if line and self._text_length(candidate.rstrip(), font, size) > width:
+                    lines.append(line.rstrip())
+                    line = word
+                else:
+                    line = candidate
+                # Words longer than the width are cut into pieces
+                while len(line) > 1 and self._text_length(line.rstrip(), font, size) > width:
+                    cut = len(line) - 1
+                    while cut > 1 and self._text_length(line[:cut], font, size) > width:
+                        cut = max(1, cut * 3 // 4)
+                    lines.append(line[:cut])
+                    line = line[cut:]
+            lines.append(line.rstrip())
+        return lines
+    
+    def _write_lines(self, lines, font, size, x=None):
+        """
+        Write lines of text at the current position, across pages.
+        
+        Returns:
+            tuple: (page number, top) of the first line
+        """
+        line_height = size * self.LINE_HEIGHT
+        x = self.MARGIN if x is None else x
+        first = None
+        for line in lines:
+            top = self._reserve(line_height)
+            if first is None:
+                first = (self._page.number, top)
+            if line:
+                self._text.append((x, top + size), line, font=font, fontsize=size)
+        return first
+    
+    def add_heading(self, text, level, bookmark_name=None):
+        """
+        Add a heading, optionally carrying a bookmark.
+        
+        Args:
+            text (str): Heading text
+            level (int): Heading level, 0 for the title
+            bookmark_name (str, optional): Bookmark to place on the heading
+            
+        Returns:
+            None
+        """
+        size, space_before = self.HEADING_STYLES.get(level, self.HEADING_STYLES[SUBHEADING_LEVEL])
+        text = INVALID_XML_CHARS.sub('', text)
+        font = self._font(text, bold=True)
+        lines = self._wrap(text, font, size, self._width)
+        
+        def write():
+            self._reserve(space_before)
+            position = self._write_lines(lines, font, size)
+            self._y += self.PARAGRAPH_SPACING / 2
+            if bookmark_name:
+                self._destinations[bookmark_name] = position
+                if 1 <= level <= TOC_LEVELS:
+                    self._toc_entries.append((level, text, bookmark_name))
+        
+        self._keep(space_before + len(lines) * size * self.LINE_HEIGHT + self.PARAGRAPH_SPACING / 2, write)
+    
+    def add_paragraph(self, text=''):
+        """
+        Add a paragraph of plain text.
+        
+        Args:
+            text (str, optional): Paragraph text
+            
+        Returns:
+            None
+        """
+        text = INVALID_XML_CHARS.sub('', text)
+        font = self._font(text)
+        lines = self._wrap(text, font, self.TEXT_SIZE, self._width)
+        line_height = self.TEXT_SIZE * self.LINE_HEIGHT
+        
+        def write():
+            self._write_lines(lines, font, self.TEXT_SIZE)
+            self._y += self.PARAGRAPH_SPACING
+        
+        if self._kept and not self._kept_paragraph and len(lines) <= self.KEPT_PARAGRAPH_LINES:
+            # E.g. the location line under a file heading
+            self._kept_paragraph = True
+            self._keep(len(lines) * line_height + self.PARAGRAPH_SPACING, write)
+            return
+        self._release(line_height)
+        write()
+    
+    def _place(self, width, aspect):
+        """
+        Reserve a rectangle for a picture or a page, scaled down to fit a page.
+        
+        Args:
+            width (float): Display width in inches
+            aspect (float): Height divided by width
+        
+        Returns:
+            Rect: Where to draw it
+        """
+        width = width * 72
+        height = width * aspect
+        # Leave room for the headings it is kept with
+        kept_height = sum(kept_height for kept_height, _ in self._kept)
+        scale = min(1, self._width / width, (self._bottom - self.MARGIN - kept_height) / height)
+        width, height = width * scale, height * scale
+        self._release(height)
+        top = self._reserve(height)
+        self._y += self.PARAGRAPH_SPACING
+        return fitz.Rect(self.MARGIN, top, self.MARGIN + width, top + height)
+    
+    def add_picture(self, image_data, width):
+        """
+        Add an image.
+        
+        Identical images are stored once.
+        
+        Args:
+            image_data (bytes): Encoded image data
+            width (float): Display width in inches
+            
+        Returns:
+            None
+        """
+        with Image.open(BytesIO(image_data)) as image:
+            image_width, image_height = image.size
+        rect = self._place(width, image_height / image_width)
+        digest = hashlib.sha1(image_data).digest()
+        xref = self._image_xrefs.get(digest)
+        if xref is None:
+            self._image_xrefs[digest] = self._page.insert_image(rect, stream=image_data)
+        else:
+            self._page.insert_image(rect, xref=xref)
+    
+    def add_pdf_page(self, pdf_data, width):
+        """
+        Add a PDF page as vector content, scaled to the given width.
+        
+        Args:
+            pdf_data (bytes): PDF document holding the page as its only page
+            width (float): Display width in inches
+            
+        Returns:
+            None
+        """
+        with fitz.open('pdf', pdf_data) as pdf:
+            source = pdf[0].rect
+            rect = self._place(width, source.height / source.width)
+            self._page.show_pdf_page(rect, pdf, 0)
+    
+    def add_table(self, rows):
+        """
+        Add a grid table.
+        
+        Args:
+            rows (list): List of rows, each a list of cell strings
+            
+        Returns:
+            None
+        """
+        cols = max((len(row) for row in rows), default=0)
+        if not cols:
+            return
+        size = self.TABLE_TEXT_SIZE
+        line_height = size * self.LINE_HEIGHT
+        col_width = self._width / cols
+        max_lines = int((self._bottom - self.MARGIN - 2 * self.CELL_PADDING) // line_height)
+        self._release(line_height + 2 * self.CELL_PADDING)
+        for row in rows:
+            cells = []
+            for cell_value in row:
+                font = self._font(cell_value)
+                lines = self._wrap(cell_value, font, size, col_width - 2 * self.CELL_PADDING)[:max_lines]
+                cells.append((font, lines))
+            height = max(len(lines) for _, lines in cells) * line_height + 2 * self.CELL_PADDING
+            top = self._reserve(height)
+            for col in range(cols):
+                left = self.MARGIN + col * col_width
+                self._shape.draw_rect(fitz.Rect(left, top, left + col_width, top + height))
+                if col >= len(cells):
+                    continue
+                font, lines = cells[col]
+                for i, line in enumerate(lines):
+                    if line:
+                        self._text.append((left + self.CELL_PADDING, top + self.CELL_PADDING + i * line_height + size),
+                                          line, font=font, fontsize=size)
+        self._y += self.PARAGRAPH_SPACING
+    
+    def add_page_break(self):
+        """
+        Add a page break.
+        
+        Returns:
+            None
+        """
+        self._release()
+        self._new_page()
+    
+    def add_toc(self):
+        """
+        Reserve the place of the table of contents.
+        
+        The entries are filled in when the report is saved, from all
+        bookmarked headings added by then, on pages inserted as needed.
+        
+        Returns:
+            None
+        """
+        self._release()
+        self._reserve(0)
+        self._toc_position = (self._page.number, self._y)
+    
+    def add_index_entry(self, filename, bookmark_name, path_context, rel_location):
+        """
+        Add a File Index entry; see add_index_entry for the arguments.
+        
+        Returns:
+            None
+        """
+        size = self.TEXT_SIZE
+        line_height = size * self.LINE_HEIGHT
+        self._release(2 * line_height + self.PARAGRAPH_SPACING)
+        top = self._reserve(2 * line_height + self.PARAGRAPH_SPACING)
+        font = self._font(filename)
+        self._link_text.append((self.MARGIN, top + size), filename, font=font, fontsize=size)
+        link_width = self._text_length(filename, font, size)
+        self._links.append((self._page.number, fitz.Rect(self.MARGIN, top, self.MARGIN + link_width, top + line_height),
+                            bookmark_name))
+        details = f" ({os.path.splitext(filename)[1]}) - {path_context}"
+        self._text.append((self.MARGIN + link_width, top + size), details, font=self._font(details), fontsize=size)
+        location = f"    Location: {rel_location}"
+        self._text.append((self.MARGIN, top + line_height + size), location, font=self._font(location),
+                          fontsize=size)
+    
+    def add_index_entries(self, entries):
+        """
+        Add File Index entries in bulk; see add_index_entry.
+        
+        Returns:
+            None
+        """
+        for entry in entries:
+            self.add_index_entry(*entry)
+    
+    def _add_toc_pages(self):
+        """
+        Write the table of contents entries at the reserved position.
+        
+        Pages are inserted after the reserved one for entries that do not
+        fit on it, which moves the pages that follow.
+        
+        Returns:
+            tuple: (page number of the reserved position, inserted pages)
+        """
+        toc_page, toc_y = self._toc_position
+        size = self.TEXT_SIZE
+        line_height = size * self.LINE_HEIGHT
+        first_page_lines = int((self._bottom - toc_y) // line_height)
+        page_lines = int((self._bottom - self.MARGIN) // line_height)
+        overflow = max(0, len(self._toc_entries) - first_page_lines)
+        inserted = -(-overflow // page_lines)
+        for i in range(inserted):
+            self.doc.new_page(toc_page + 1 + i, width=self.PAGE_WIDTH, height=self.PAGE_HEIGHT)
+        
+        def moved(page_number):
+            return page_number + inserted if page_number > toc_page else page_number
+        
+        page_number, y, page, text, link_text = toc_page, toc_y, None, None, None
+        for level, title, bookmark_name in self._toc_entries:
+            if y + line_height > self._bottom:
+                text.write_text(page)
+                link_text.write_text(page)
+                page_number, y, text = page_number + 1, self.MARGIN, None
+            if text is None:
+                page = self.doc[page_number]
+                text = fitz.TextWriter(page.rect)
+                link_text = fitz.TextWriter(page.rect, color=self.LINK_COLOR)
+            target_page, target_y = self._destinations[bookmark_name]
+            label = str(moved(target_page) + 1)
+            font = self._font(title)
+            indent = self.MARGIN + (level - 1) * 12
+            label_width = self._text_length(label, self._fonts[False], size)
+            available = self._width - (indent - self.MARGIN) - label_width - 12
+            title = self._wrap(title, font, size, available)[0]
+            link_text.append((indent, y + size), title, font=font, fontsize=size)
+            text.append((self.MARGIN + self._width - label_width, y + size), label, font=self._fonts[False],
+                        fontsize=size)
+            page.insert_link({
+                'kind': fitz.LINK_GOTO, 'from': fitz.Rect(indent, y, self.MARGIN + self._width, y + line_height),
+                'page': moved(target_page), 'to': fitz.Point(0, target_y),
+            })
+            y += line_height
+        if text is not None:
+            text.write_text(page)
+            link_text.write_text(page)
+        return toc_page, inserted
+    
+    def _finish(self):
+        """
+        Add the table of contents, the links and the outline, once.
+        
+        Returns:
+            None
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._release()
+        self._flush()
+        toc_page, inserted = -1, 0
+        if self._toc_position is not None and self._toc_entries:
+            toc_page, inserted = self._add_toc_pages()
+        
+        def moved(page_number):
+            return page_number + inserted if page_number > toc_page else page_number
+        
+        for page_number, rect, bookmark_name in self._links:
+            target = self._destinations.get(bookmark_name)
+            if target is not None:
+                self.doc[moved(page_number)].insert_link({
+                    'kind': fitz.LINK_GOTO, 'from': rect,
+                    'page': moved(target[0]), 'to': fitz.Point(0, target[1]),
+                })
+        
+        # File sections (level 2) are top-level outline entries beside the
+        # File Index, with their sheets (level 3) below them; levels may
+        # only grow one at a time
+        outline = []
+        previous_level = 0
+        for level, title, bookmark_name in self._toc_entries:
+            level = min(max(1, level - 1), previous_level + 1)
+            page_number, y = self._destinations[bookmark_name]
+            outline.append([level, title, moved(page_number) + 1, {'kind': fitz.LINK_GOTO, 'to': fitz.Point(0, y)}])
+            previous_level = level
+        self.doc.set_toc(outline)
+        if self._uses_fallback_font:
+            # Only embed the glyphs used from the large fallback font
+            self.doc.subset_fonts()
+    
+    def save(self, path):
+        """
+        Save the report.
+        
+        Args:
+            path (str): Output path
+            
+        Returns:
+            None
+        """
+        self._finish()
+        self.doc.save(path, garbage=1, deflate=True)
+    
+    def close(self):
+        """
+        Release the document.
+        
+        Returns:
+            None
+        """
+        self.doc.close()
+
+
+def get_path_context(file_path, input_dir=None, levels=3):
+    """
+    Extract the last N levels of a file path for better context.
+    If input_dir is provided, returns path context relative to input directory.
+    
+    Args:
+        file_path (str): Full file path
+        input_dir (str, optional): Input directory path to make the context relative to
+        levels (int, optional): Number of directory levels to include. Defaults to 3.
+        
+    Returns:
+        str: String representing the path context with N levels
+    """
+    # If input_dir is provided, try to make the path relative first
+    if input_dir:
+        try:
+            # Normalize paths to handle different path separators
+            norm_file_path = os.path.normpath(file_path)
+            norm_input_dir = os.path.normpath(input_dir)
+            
+            # Check if the file is in the input directory
+            if norm_file_path.startswith(norm_input_dir):
+                # Get the relative path and work with that
+                rel_path = os.path.relpath(norm_file_path, norm_input_dir)
+                path = os.path.dirname(rel_path)
+                
+                # If it's directly in the input directory
+                if path == "":
+                    return "."  # Return dot to indicate it's in the root input directory
+                    
+                # Otherwise process the parts of the relative path
+                parts = path.split(os.sep)
+                if len(parts) <= levels:
+                    return path  # Return the whole relative path if it's shorter than levels
+                else:
+                    return os.path.join(*parts[-levels:])  # Return last N levels of the relative path
+                
+            # If file is not in input directory, fall back to absolute path processing
+        except Exception:
+            pass  # Fall back to absolute path processing
+    
+    # Process absolute path (original behavior)
+    parts = []
+    path = os.path.dirname(file_path)
+    
+    for _ in range(levels):
+        head, tail = os.path.split(path)
+        if tail:
+            parts.insert(0, tail)
+        path = head
+        if not path or path == os.path.sep:
+            break
+    
+    if parts:
+        return os.path.join(*parts)
+    return os.path.dirname(file_path)
+
+
+def get_relative_path(file_path, input_dir):
+    """
+    Get the path of a file relative to the input directory.
+    
+    Args:
+        file_path (str): Full path to the file
+        input_dir (str): Input directory path
+        
+    Returns:
+        str: Path relative to input directory, or full path if not a subpath
+    """
+    try:
+        # Normalize paths to handle different path separators
+        norm_file_path = os.path.normpath(file_path)
+        norm_input_dir = os.path.normpath(input_dir)
+        
+        # Check if the file is in the input directory
+        if norm_file_path.startswith(norm_input_dir):
+            rel_path = os.path.relpath(norm_file_path, norm_input_dir)
+            parent_dir = os.path.dirname(rel_path)
+            return parent_dir if parent_dir else "."  # Return "." if in root input dir
+        else:
+            return os.path.dirname(file_path)  # Fall back to full path if not in input dir
+    except Exception:
+        return os.path.dirname(file_path)  # Fall back in case of error
+
+
+# Supported file types, in the order they are matched against file extensions
+FILE_TYPES = (
+    ('pdf', ('.pdf',)),
+    ('word', ('.doc', '.docx', '.odt')),
+    ('excel', ('.xls', '.xlsx', '.ods')),
+    ('image', ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff')),
+    ('text', ('.txt', '.log', '.md', '.csv')),
+)
+
+# Processor used for each file type
+FILE_PROCESSORS = {
+    'pdf': process_pdf,
+    'word': process_word,
+    'excel': process_excel,
+    'image': process_image,
+    'text': process_text,
+}
+
+
+def get_file_kind(file_path):
+    """
+    Determine the file type of a file from its extension.
+    
+    Args:
+        file_path (str): Path or name of the file
+        
+    Returns:
+        str: Key into FILE_PROCESSORS, or None if the file is not supported
+    """
+    ext = file_path.lower()
+    for kind, extensions in FILE_TYPES:
+        if ext.endswith(extensions):
+            return kind
+    return None
+
+
+class FileEntry:
+    """
+    Record of a file found by the scan.
+    
+    Everything the report needs about a file's location is derived once
+    here, so the processing loop and the File Index do not run the path
+    helpers again. Slots keep the records small on trees with millions of
+    files.
+    """
+    
+    __slots__ = ('path', 'name', 'ext', 'kind', 'rel_dir', 'context', 'size', 'mtime_ns', 'bookmark')
+    
+    def __init__(self, path, name, rel_dir, context, size=None, mtime_ns=None):
+        # Absolute path to the file
+        self.path = path
+        self.name = name
+        self.ext = os.path.splitext(name)[1].lower()
+        # Key into FILE_PROCESSORS, from the extension until sniffed
+        self.kind = get_file_kind(name)
+        # Parent directory relative to the input directory, and its last levels
+        self.rel_dir = rel_dir
+        self.context = context
+        # None when the file could not be stat'ed
+        self.size = size
+        self.mtime_ns = mtime_ns
+        # Assigned by the report's BookmarkRegistry
+        self.bookmark = None
+
+
+def get_dir_context(rel_path, levels=3):
+    """
+    Get the location strings shared by the files of a directory.
+    
+    Equivalent to get_relative_path and get_path_context for files of an
+    input subdirectory, computed once per directory.
+    
+    Args:
+        rel_path (str): Directory path from the input directory, '/'-separated
+        levels (int, optional): Number of directory levels in the context.
+            Defaults to 3.
+        
+    Returns:
+        tuple: (relative directory, path context), both '.' for the input
+            directory itself
+    """
+    if not rel_path:
+        return ".", "."
+    parts = rel_path.split('/')
+    return os.sep.join(parts), os.sep.join(parts[-levels:])
+
+
+# Name of the files listing exclude patterns for their directory's subtree
+IGNORE_FILE_NAME = '.converterignore'
+
+
+def anchor_pattern(pattern, base=''):
+    """
+    Normalize an include or exclude glob pattern.
+    
+    Patterns without a slash match file and directory names at any depth;
+    'name/' matches directories only. Other patterns match the path from
+    the input directory, given as '/dir/file' with directories ending in
+    '/': they are anchored at base unless they start with '*'.
+    
+    Args:
+        pattern (str): Glob pattern
+        base (str, optional): Directory the pattern is relative to, from the
+            input directory. Defaults to '' (the input directory).
+        
+    Returns:
+        str: Pattern for path_matches
+    """
+    pattern = pattern.replace(os.sep, '/')
+    if '/' not in pattern:
+        return pattern
+    if '/' not in pattern.rstrip('/'):
+        return '*/' + pattern
+    if pattern.startswith('*'):
+        return pattern
+    return '/' + '/'.join(part for part in (base, pattern.lstrip('/')) if part)
+
+
+def path_matches(patterns, rel_path, name, is_dir):
+    """
+    Check whether a path matches any of a list of patterns.
+    
+    Args:
+        patterns (list): Patterns returned by anchor_pattern
+        rel_path (str): Path from the input directory, '/'-separated
+        name (str): File or directory name
+        is_dir (bool): Whether the path is a directory
+        
+    Returns:
+        bool: True if a pattern matches
+    """
+    target = '/' + rel_path + ('/' if is_dir else '')
+    for pattern in patterns:
+        if fnmatch.fnmatch(target if '/' in pattern else name, pattern):
+            return True
+    return False
+
+
+def read_ignore_file(path, base):
+    """
+    Read the exclude patterns of a .converterignore file.
+    
+    One glob pattern per line; blank lines and lines starting with '#' are
+    skipped.
+    
+    Args:
+        path (str): Path to the ignore file
+        base (str): Directory holding it, from the input directory
+        
+    Returns:
+        list: Patterns returned by anchor_pattern
+    """
+    patterns = []
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(anchor_pattern(line, base))
+    except OSError as e:
+        print(f"Cannot read {path}: {str(e)}")
+    return patterns
+
+
+def list_input_dir(path, rel_path, exclude, include, accept, sniff):
+    """
+    List one directory of the input tree, applying the filters.
+    
+    Accepted files are stat'ed and sniffed here, so that this work also runs
+    on the thread pool when listing is concurrent.
+    
+    Args:
+        path (str): Directory to list
+        rel_path (str): Its path from the input directory, '/'-separated
+        exclude (list): Exclude patterns in effect for this directory
+        include (list): Include patterns files must match, if any
+        accept (callable): Called with a file name, False to skip the file
+        sniff (callable): Called with a file path, returns the file type or
+            None to skip the file; None to keep the types of the extensions
+        
+    Returns:
+        tuple: (files, subdirectories) where files is a list of FileEntry
+            and subdirectories a list of list_input_dir arguments, both
+            sorted by name
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as e:
+        print(f"Cannot list {path}: {str(e)}")
+        return [], []
+    
+    if any(entry.name == IGNORE_FILE_NAME for entry in entries):
+        exclude = exclude + read_ignore_file(os.path.join(path, IGNORE_FILE_NAME), rel_path)
+    
+    rel_dir, context = get_dir_context(rel_path)
+    files = []
+    subdirs = []
+    for entry in entries:
+        entry_rel_path = f"{rel_path}/{entry.name}" if rel_path else entry.name
+        try:
+            is_dir = entry.is_dir()
+            if not is_dir and not entry.is_file():
+                continue
+        except OSError:
+            continue
+        if entry.name == IGNORE_FILE_NAME or path_matches(exclude, entry_rel_path, entry.name, is_dir):
+            # Excluded directories are pruned without being listed
+            continue
+        if is_dir:
+            # Like os.walk, do not follow symbolic links to directories
+            if not entry.is_symlink():
+                subdirs.append((entry.path, entry_rel_path, exclude, include, accept, sniff))
+        elif ((not include or path_matches(include, entry_rel_path, entry.name, False))
+                and accept(entry.name)):
+            try:
+                st = entry.stat()
+                file_entry = FileEntry(entry.path, entry.name, rel_dir, context, st.st_size, st.st_mtime_ns)
+            except OSError:
+                file_entry = FileEntry(entry.path, entry.name, rel_dir, context)
+            if sniff is not None:
+                file_entry.kind = sniff(entry.path)
+                if file_entry.kind is None:
+                    continue
+            files.append(file_entry)
+    return files, subdirs
+
+
+def scan_input_dir(input_dir, include=(), exclude=(), accept=None, threads=1, sniff=None):
+    """
+    Scan the input directory for files.
+    
+    Excluded subtrees (exclude patterns and the patterns of .converterignore
+    files) are pruned before being descended into. With more than one
+    thread, directories are listed concurrently, which helps on network
+    shares; the order stays that of a sorted top-down walk either way.
+    
+    Args:
+        input_dir (str): Input directory
+        include (iterable, optional): Glob patterns files must match, if any
+        exclude (iterable, optional): Glob patterns of files and directories
+            to skip
+        accept (callable, optional): Called with each file name, False to
+            skip the file. Defaults to accepting every file.
+        threads (int, optional): Number of threads listing directories.
+            Defaults to 1.
+        sniff (callable, optional): Called with each accepted file's path,
+            returns its type (e.g. FileTypeSniffer.sniff) or None to skip
+            the file. Defaults to the types of the file extensions.
+        
+    Returns:
+        list: FileEntry of every file, each directory's files before its
+            subdirectories, both sorted by name
+    """
+    input_dir = os.path.abspath(input_dir)
+    include = [anchor_pattern(pattern) for pattern in include]
+    exclude = [anchor_pattern(pattern) for pattern in exclude]
+    accept = accept or (lambda name: True)
+    root = (input_dir, '', exclude, include, accept, sniff)
+    found = []
+    
+    if threads <= 1:
+        pending = [root]
+        while pending:
+            files, subdirs = list_input_dir(*pending.pop())
+            found.extend(files)
+            pending.extend(reversed(subdirs))
+        return found
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        def list_dir_task(*args):
+            # Queue the subdirectories as soon as they are known
+            files, subdirs = list_input_dir(*args)
+            return files, [executor.submit(list_dir_task, *subdir) for subdir in subdirs]
+        
+        # Consume the listings in walk order while the threads run ahead
+        pending = [executor.submit(list_dir_task, *root)]
+        while pending:
+            files, subdirs = pending.pop().result()
+            found.extend(files)
+            pending.extend(reversed(subdirs))
+    return found
+
+
+# Leading bytes of each file read to sniff its type
+SNIFF_BYTES = 512
+
+# Signatures at the start of a file and the file type they identify
+FILE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image'),
+    (b'\xff\xd8\xff', 'image'),
+    (b'GIF87a', 'image'),
+    (b'GIF89a', 'image'),
+    (b'II*\x00', 'image'),
+    (b'MM\x00*', 'image'),
+)
+
+# BMP file signature, and the sizes of the DIB header that follows the
+# 14 byte file header in valid bitmaps
+BMP_SIGNATURE = b'BM'
+BMP_DIB_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)
+
+# PDF header, e.g. '%PDF-1.7'
+PDF_HEADER = re.compile(rb'%PDF-\d\.\d')
+# Longest binary prefix accepted before the PDF header
+PDF_PREFIX_BYTES = 64
+
+# OLE2 compound file signature (.doc, .xls)
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Zip local file header signature (OOXML, ODF)
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+# OLE2 streams and zip parts identifying Word and Excel documents
+OLE2_STREAMS = (('WordDocument', 'word'), ('Workbook', 'excel'), ('Book', 'excel'))
+PACKAGE_PARTS = (('word/document.xml', 'word'), ('xl/workbook.xml', 'excel'))
+ODF_MIMETYPES = (('application/vnd.oasis.opendocument.text', 'word'),
+                 ('application/vnd.oasis.opendocument.spreadsheet', 'excel'))
+
+# Extensions of zip packages, trusted for files with a zip signature
+PACKAGE_EXTENSIONS = ('.docx', '.xlsx', '.odt', '.ods')
+
+# Control bytes that do not occur in text, apart from tab, line breaks,
+# form feeds and ANSI escape sequences
+BINARY_BYTES = bytes(set(range(32)) - {9, 10, 12, 13, 27})
+
+# Shortest sample judged on its share of control bytes; shorter ones are
+# text unless they hold NULs
+TEXT_RATIO_MIN_BYTES = 128
+
+
+class FileTypeSniffer:
+    """
+    Determine file types from their content instead of their extension.
+    
+    Only the first SNIFF_BYTES of a file are read, into a buffer reused for
+    every file (one per thread, so the scan threads can share a sniffer).
+    Zip packages and OLE2 files additionally have their part or stream
+    names looked up to tell Word from Excel documents.
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+    
+    def sniff(self, file_path):
+        """
+        Determine the type of a file.
+        
+        A recognized signature wins over the extension, so misnamed files
+        reach the right processor and files without an extension are
+        included. Files with a text extension keep it when their content
+        looks like text, as signatures made of printable characters (%PDF-,
+        GIF8, BM) also start ordinary text; with binary content they are
+        rejected.
+        
+        Args:
+            file_path (str): Path to the file
+            
+        Returns:
+            str: Key into FILE_PROCESSORS, or None if the file is not supported
+        """
+        ext_kind = get_file_kind(file_path)
+        local = self._local
+        if not hasattr(local, 'buffer'):
+            local.buffer = bytearray(SNIFF_BYTES)
+            local.view = memoryview(local.buffer)
+        try:
+            with open(file_path, 'rb') as f:
+                header = local.view[:f.readinto(local.buffer)].tobytes()
+        except OSError:
+            return ext_kind
+        
+        if ext_kind == 'text' and self.is_text(header):
+            return 'text'
+        if self.is_pdf(header):
+            return 'pdf'
+        for signature, kind in FILE_SIGNATURES:
+            if header.startswith(signature):
+                return kind
+        if (header.startswith(BMP_SIGNATURE)
+                and int.from_bytes(header[14:18], 'little') in BMP_DIB_HEADER_SIZES):
+            return 'image'
+        if header.startswith(OLE2_SIGNATURE):
+            return self._sniff_ole2(file_path, header, ext_kind)
+        if header.startswith(ZIP_SIGNATURE):
+            return self._sniff_package(file_path, header, ext_kind)
+        
+        if ext_kind == 'text':
+            # Binary content behind a text extension
+            print(f"Warning: skipping {file_path}: binary content in a text file")
+            return None
+        # Unrecognized content: trust a known extension
+        return ext_kind
+    
+    @staticmethod
+    def is_pdf(header):
+        """
+        Check whether the leading bytes of a file are a PDF header.
+        
+        The header must start the file, or follow a short binary prefix
+        that some producers write before it.
+        
+        Args:
+            header (bytes): Leading bytes of the file
+            
+        Returns:
+            bool: True if the file is a PDF
+        """
+        match = PDF_HEADER.search(header, 0, PDF_PREFIX_BYTES + 8)
+        if match is None:
+            return False
+        prefix = header[:match.start()]
+        return not prefix or len(prefix.translate(None, BINARY_BYTES)) < len(prefix)
+    
+    @staticmethod
+    def is_text(header):
+        """
+        Check whether the leading bytes of a file look like text.
+        
+        Args:
+            header (bytes): Leading bytes of the file
+            
+        Returns:
+            bool: False if the bytes hold NULs (outside UTF-16 text) or
+                many other control bytes
+        """
+        if find_bom(header) is not None or find_utf16_without_bom(header) is not None:
+            return True
+        if b'\x00' in header:
+            return False
+        if len(header) < TEXT_RATIO_MIN_BYTES:
+            return True
+        return len(header.translate(None, BINARY_BYTES)) >= len(header) * 0.95
+    
+    def _sniff_ole2(self, file_path, header, ext_kind):
+        # Look for the document stream in the first directory sector, also
+        # behind a .doc or .xls extension, which may name the wrong one
+        try:
+            sector_size = 1 << int.from_bytes(header[30:32], 'little')
+            directory_sector = int.from_bytes(header[48:52], 'little')
+            with open(file_path, 'rb') as f:
+                f.seek((directory_sector + 1) * sector_size)
+                directory = f.read(sector_size)
+        except (OSError, ValueError, OverflowError):
+            directory = b''
+        for offset in range(0, len(directory) - 127, 128):
+            name_length = int.from_bytes(directory[offset + 64:offset + 66], 'little')
+            name = directory[offset:offset + max(name_length - 2, 0)].decode('utf-16-le', errors='replace')
+            for stream, kind in OLE2_STREAMS:
+                if name == stream:
+                    return kind
+        # Stream not found (e.g. listed in a later directory sector): trust
+        # an Office extension
+        return ext_kind if ext_kind in ('word', 'excel') else None
+    
+    def _sniff_package(self, file_path, header, ext_kind):
+        # ODF stores its uncompressed mimetype as the first entry
+        for mimetype, kind in ODF_MIMETYPES:
+            if header[30:38] == b'mimetype' and header[38:38 + len(mimetype)] == mimetype.encode('ascii'):
+                return kind
+        if file_path.lower().endswith(PACKAGE_EXTENSIONS):
+            # The extension agrees with the content, spare reading the
+            # central directory
+            return ext_kind
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                names = set(archive.namelist())
+        except (OSError, zipfile.BadZipFile):
+            return None
+        for part, kind in PACKAGE_PARTS:
+            if part in names:
+                return kind
+        return None
 
 
-def process_image(file_path, doc):
+def build_file_preview(file_path, kind, settings=None):
     """
-    Process an image file and add it to the document.
+    Build the preview of a single file.
     
-    Uses PIL to handle various image formats and ensure proper
-    embedding in the Word document.
+    This is the unit of work handed to worker processes, so it only takes
+    and returns picklable values.
     
     Args:
-        file_path (str): Path to the image file
-        doc (Document): Word document object
+        file_path (str): Path to the file
+        kind (str): File type as returned by get_file_kind
+        settings (RenderSettings, optional): Render settings
         
     Returns:
-        None
+        FilePreview: Preview of the file
     """
-    try:
-        # Load the image with PIL first to ensure proper handling
-        img = Image.open(file_path)
-        
-        # Save to BytesIO to avoid file system operations
-        img_byte_arr = BytesIO()
-        img.save(img_byte_arr, format=img.format)
-        img_byte_arr.seek(0)
-        
-        # Add to document with explicit float width
-        doc.add_picture(img_byte_arr, width=Inches(6.0))
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
+    preview = FilePreview()
+    start = time.perf_counter()
+    FILE_PROCESSORS[kind](file_path, preview, settings)
+    preview.timings['total'] = time.perf_counter() - start
+    return preview
 
 
-def process_text(file_path, doc):
+def lookup_cached_preview(cache, file_path, settings, digest=None):
     """
-    Process a text file and add its content to the document.
-    
-    Handles various encodings and special formats like CSV.
-    Attempts multiple encodings to handle Chinese text properly.
+    Look up the cached preview of a file.
     
     Args:
-        file_path (str): Path to the text file
-        doc (Document): Word document object
+        cache (PreviewCache): Preview cache, or None when caching is disabled
+        file_path (str): Path to the file
+        settings (RenderSettings): Render settings
+        digest (str, optional): Digest of the preview recorded for this
+            unchanged file in the previous run's manifest
         
     Returns:
-        None
+        tuple: (cache key, FilePreview) where either may be None
     """
+    if cache is None:
+        return None, None
+    if digest is not None:
+        preview = cache.load(digest)
+        if preview is not None:
+            cache.hits += 1
+            return None, preview
     try:
-        # Check if this is a CSV file based on extension
-        is_csv = file_path.lower().endswith('.csv')
+        key = cache.make_key(file_path, settings)
+    except OSError:
+        return None, None
+    return key, cache.get(key)
+
+
+def iter_file_previews(tasks, jobs=1, settings=None, cache=None, known_digests=None, file_settings=None):
+    """
+    Build the previews for a list of files, yielding them in task order.
+    
+    Previews found in the cache are reused; new previews are stored in it.
+    With more than one job the previews are built in a process pool. Only a
+    bounded window of tasks is in flight at any time, so finished previews
+    waiting behind a slow file do not pile up in memory.
+    
+    Args:
+        tasks (list): FileEntry of each file
+        jobs (int, optional): Number of worker processes. Defaults to 1.
+        settings (RenderSettings, optional): Render settings
+        cache (PreviewCache, optional): Preview cache. Defaults to None.
+        known_digests (dict, optional): Preview digests of unchanged files,
+            keyed by file path, loaded from the cache without rebuilding a key
+        file_settings (dict, optional): Render settings of individual files,
+            keyed by file path, replacing settings for those files
         
-        # Try different encodings for Chinese files
-        encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5', 'utf-16']
+    Yields:
+        FilePreview: Preview of each task, in the same order as tasks
+    """
+    settings = settings or RenderSettings()
+    known_digests = known_digests or {}
+    file_settings = file_settings or {}
+    
+    if jobs <= 1:
+        for entry in tasks:
+            file_path = entry.path
+            task_settings = file_settings.get(file_path, settings)
+            key, preview = lookup_cached_preview(cache, file_path, task_settings, known_digests.get(file_path))
+            if preview is None:
+                preview = build_file_preview(file_path, entry.kind, task_settings)
+                if key is not None:
+                    cache.put(key, preview)
+            yield preview
+        return
+    
+    window = jobs * 2
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    
+    def submit(entry, task_settings):
+        try:
+            return executor.submit(build_file_preview, entry.path, entry.kind, task_settings)
+        except BrokenProcessPool as e:
+            # Handled like the crash itself once the task is next in order
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+            return future
+    
+    def error_preview(file_path, e):
+        print(f"Error processing {file_path}: {str(e)}")
+        preview = FilePreview()
+        preview.add_paragraph(f"Error processing {file_path}: {str(e)}")
+        preview.failed = True
+        return preview
+    
+    try:
+        task_iter = iter(tasks)
+        # (FileEntry, render settings, cache key, Future or cached FilePreview), in task order
+        pending = deque()
+        in_flight = 0
         
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    if is_csv:
-                        # For CSV files, create a table representation
-                        import csv
-                        reader = csv.reader(f)
-                        
-                        # Get the first rows (up to 10)
-                        rows = []
-                        for i, row in enumerate(reader):
-                            if i < 10:  # Limit to first 10 rows
-                                rows.append(row)
-                            else:
-                                break
-                        
-                        if rows:
-                            # Create a table
-                            table = doc.add_table(rows=len(rows), cols=len(rows[0]))
-                            table.style = 'Table Grid'
-                            
-                            # Fill the table with data
-                            for i, row in enumerate(rows):
-                                for j, cell_value in enumerate(row):
-                                    if j < len(table.rows[i].cells):  # Ensure we don't exceed column count
-                                        table.rows[i].cells[j].text = cell_value
-                                    
-                            doc.add_paragraph(f"CSV data presented as table (first 10 rows). Detected encoding: {encoding}")
-                        else:
-                            doc.add_paragraph("CSV file appears to be empty.")
-                    else:
-                        # For regular text files
-                        content = ''.join(f.readlines()[:10])  # First 10 lines
-                        doc.add_paragraph(content)
-                        doc.add_paragraph(f"Detected encoding: {encoding}")
-                    
-                    # If we get here without an exception, we found the right encoding
+        while True:
+            # Keep the pool busy without reading too far ahead through cache hits
+            while in_flight < window and len(pending) < window * 4:
+                entry = next(task_iter, None)
+                if entry is None:
                     break
-            except UnicodeDecodeError:
-                # If this encoding doesn't work, try the next one
-                if encoding == encodings[-1]:  # If this was the last encoding in our list
-                    doc.add_paragraph(f"Could not decode file with any of the attempted encodings.")
-                    print(f"Error processing {file_path}: Could not decode with any of the attempted encodings")
+                file_path = entry.path
+                task_settings = file_settings.get(file_path, settings)
+                key, preview = lookup_cached_preview(cache, file_path, task_settings, known_digests.get(file_path))
+                if preview is None:
+                    preview = submit(entry, task_settings)
+                    in_flight += 1
+                pending.append((entry, task_settings, key, preview))
+            
+            if not pending:
+                break
+            
+            entry, task_settings, key, result = pending.popleft()
+            if isinstance(result, FilePreview):
+                yield result
                 continue
+            
+            in_flight -= 1
+            try:
+                preview = result.result()
+            except BrokenProcessPool:
+                # A worker died abruptly (e.g. crashed inside a native library),
+                # failing every task in flight. Rerun this file alone in a new
+                # pool to find out whether it caused the crash, then resubmit
+                # the other files that were lost with the pool.
+                executor.shutdown(wait=False)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+                try:
+                    preview = executor.submit(build_file_preview, entry.path, entry.kind, task_settings).result()
+                except BrokenProcessPool as e:
+                    preview = error_preview(entry.path, e)
+                    executor.shutdown(wait=False)
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+                except Exception as e:
+                    preview = error_preview(entry.path, e)
+                
+                lost = [item[3] for item in pending if not isinstance(item[3], FilePreview)]
+                concurrent.futures.wait(lost)
+                for index, (other, other_settings, other_key, other_result) in enumerate(pending):
+                    if other_result in lost and isinstance(other_result.exception(), BrokenProcessPool):
+                        pending[index] = (other, other_settings, other_key, submit(other, other_settings))
             except Exception as e:
-                # Handle other exceptions
-                print(f"Error processing {file_path} with encoding {encoding}: {str(e)}")
-                doc.add_paragraph(f"Error processing file: {str(e)}")
-                break
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
-        doc.add_paragraph(f"Error processing {file_path}: {str(e)}")
+                preview = error_preview(entry.path, e)
+            if key is not None:
+                cache.put(key, preview)
+            yield preview
+    finally:
+        executor.shutdown()
 
 
-def add_bookmark(paragraph, bookmark_name):
+def get_manifest_path(output_file):
     """
-    Add a bookmark to a paragraph.
+    Get the path of the run manifest written beside a report.
     
     Args:
-        paragraph (Paragraph): Paragraph object to add bookmark to
-        bookmark_name (str): Name of the bookmark
+        output_file (str): Path of the report
         
     Returns:
-        str: Name of the bookmark that was added
+        str: Path of the manifest file
     """
-    run = paragraph.add_run()
-    tag = run._r
-    start = OxmlElement('w:bookmarkStart')
-    start.set(qn('w:id'), '0')
-    start.set(qn('w:name'), bookmark_name)
-    tag.append(start)
-    
-    end = OxmlElement('w:bookmarkEnd')
-    end.set(qn('w:id'), '0')
-    tag.append(end)
-    
-    return bookmark_name
+    return os.path.abspath(output_file) + '.manifest.json'
 
 
-def get_valid_bookmark_name(file_path):
+def load_manifest(manifest_path):
     """
-    Convert a file path to a valid bookmark name.
-    
-    Removes invalid characters and ensures uniqueness with prefixing.
+    Load the manifest of a previous run.
     
     Args:
-        file_path (str): File path to convert to bookmark name
+        manifest_path (str): Path of the manifest file
         
     Returns:
-        str: Valid bookmark name
+        dict: The manifest, or None if it is missing or unreadable
     """
-    # Remove invalid characters and replace with underscores
-    name = os.path.basename(file_path)
-    name = name.replace('.', '_').replace(' ', '_')
-    # Add a prefix to ensure uniqueness
-    return f"bm_{name}"
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != PreviewCache.VERSION:
+        return None
+    return manifest
 
 
-def add_internal_hyperlink(paragraph, anchor_text, bookmark_name, tooltip=None):
+def write_manifest(manifest_path, manifest):
     """
-    Add an internal hyperlink to a paragraph.
-    
-    Creates a clickable link to navigate within the document.
+    Write a run manifest, replacing the previous one atomically.
     
     Args:
-        paragraph (Paragraph): Paragraph object to add hyperlink to
-        anchor_text (str): Text to display as the hyperlink
-        bookmark_name (str): Name of the bookmark to link to
-        tooltip (str, optional): Tooltip text for the hyperlink
+        manifest_path (str): Path of the manifest file
+        manifest (dict): Manifest to write
         
     Returns:
         None
     """
-    hyperlink = OxmlElement('w:hyperlink')
-    hyperlink.set(qn('w:anchor'), bookmark_name)
-    
-    if tooltip:
-        hyperlink.set(qn('w:tooltip'), tooltip)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def update_fields_with_word(report_path):
+    """
+    Update all fields of a saved report (e.g. TOC page numbers) with Microsoft Word.
     
-    new_run = OxmlElement('w:r')
-    hyperlink.append(new_run)
+    Args:
+        report_path (str): Absolute path of the report
+        
+    Returns:
+        None
+    """
+    if win32com is None:
+        print("Microsoft Word is not available, skipping the field update.")
+        return
     
-    rPr = OxmlElement('w:rPr')
-    new_run.append(rPr)
+    # Update TOC using Word COM interface
+    pythoncom.CoInitialize()
     
-    rStyle = OxmlElement('w:rStyle')
-    rStyle.set(qn('w:val'), 'Hyperlink')
-    rPr.append(rStyle)
+    word = win32com.client.DispatchEx("Word.Application")
+    word.Visible = False
     
-    t = OxmlElement('w:t')
-    t.text = anchor_text
-    new_run.append(t)
+    # Use absolute path when opening with Word
+    word_doc = word.Documents.Open(report_path)
+    word_doc.Fields.Update()
+    word_doc.Save()
+    word_doc.Close()
     
-    paragraph._p.append(hyperlink)
+    # Release the Word application instead of quitting
+    word = None
+    pythoncom.CoUninitialize()
 
 
-def add_hyperlink(paragraph, text, url):
+# Render steps tried, from best to smallest, when fitting a report into a
+# size budget: (PDF zoom, image DPI, JPEG quality)
+BUDGET_STEPS = (
+    (2.0, 150, 85),
+    (2.0, 150, 70),
+    (1.5, 120, 70),
+    (1.5, 120, 55),
+    (1.25, 96, 55),
+    (1.0, 72, 50),
+    (1.0, 72, 35),
+    (0.75, 54, 35),
+    (0.5, 36, 30),
+)
+
+# Approximate JPEG bytes per pixel of page renders and photos, by minimum quality
+JPEG_BYTES_PER_PIXEL = ((90, 0.45), (80, 0.3), (70, 0.22), (55, 0.17), (40, 0.13), (0, 0.1))
+
+# Approximate bytes per pixel of downscaled images re-encoded as PNG
+PNG_BYTES_PER_PIXEL = 1.0
+
+# Report bytes besides the previews: fixed part, and headings and index entry of each file
+REPORT_BASE_BYTES = 64 * 1024
+REPORT_BYTES_PER_FILE = 2 * 1024
+
+# Share of the size budget planned for, leaving a margin for estimation errors
+BUDGET_MARGIN = 0.9
+
+# Page size assumed for documents converted to PDF (US Letter, in points)
+DEFAULT_PAGE_SIZE = (612, 792)
+
+
+def measure_preview_source(file_path, kind):
     """
-    Add an external hyperlink to a paragraph.
+    Measure what a file's preview picture is made from, without rendering it.
     
-    Creates a clickable link to an external resource.
+    Only headers are read: the first page size of PDFs and the pixel size
+    of images.
     
     Args:
-        paragraph (Paragraph): Paragraph object to add hyperlink to
-        text (str): Text to display as the hyperlink
-        url (str): URL to link to
+        file_path (str): Path to the file
+        kind (str): File type as returned by get_file_kind
         
     Returns:
-        None
+        tuple: ('page', width, height) in points, ('image', width, height,
+            format, file size), or None if the preview has no picture
     """
-    # Add a hyperlink to a paragraph
-    part = paragraph.part
-    r_id = part.relate_to(url, docx.opc.constants.RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
-    
-    hyperlink = OxmlElement('w:hyperlink')
-    hyperlink.set(qn('r:id'), r_id)
-    
-    new_run = OxmlElement('w:r')
-    hyperlink.append(new_run)
-    
-    rPr = OxmlElement('w:rPr')
-    new_run.append(rPr)
-    
-    rStyle = OxmlElement('w:rStyle')
-    rStyle.set(qn('w:val'), 'Hyperlink')
-    rPr.append(rStyle)
+    if kind in ('word', 'excel'):
+        return ('page',) + DEFAULT_PAGE_SIZE
+    if kind == 'pdf':
+        try:
+            with fitz.open(file_path) as pdf:
+                rect = pdf[0].rect
+                return ('page', rect.width, rect.height)
+        except Exception:
+            return ('page',) + DEFAULT_PAGE_SIZE
+    if kind == 'image':
+        try:
+            with Image.open(file_path) as img:
+                return ('image', img.width, img.height, img.format, os.path.getsize(file_path))
+        except Exception:
+            return None
+    return None
+
+
+def estimate_preview_bytes(source, zoom, dpi, quality, page_format='jpeg'):
+    """
+    Estimate the encoded size of a preview picture at a render step.
     
-    t = OxmlElement('w:t')
-    t.text = text
-    new_run.append(t)
+    Args:
+        source (tuple): Result of measure_preview_source
+        zoom (float): Zoom factor of PDF page renders
+        dpi (int): Resolution of images at their display width
+        quality (int): JPEG quality
+        page_format (str, optional): Encoding of rendered pages, 'png' or
+            'jpeg'. Defaults to 'jpeg'.
+        
+    Returns:
+        float: Estimated bytes
+    """
+    bytes_per_pixel = next(bpp for minimum, bpp in JPEG_BYTES_PER_PIXEL if quality >= minimum)
+    if source[0] == 'page':
+        if page_format != 'jpeg':
+            bytes_per_pixel = PNG_BYTES_PER_PIXEL
+        return source[1] * zoom * source[2] * zoom * bytes_per_pixel
     
-    paragraph._p.append(hyperlink)
+    _, width, height, image_format, file_size = source
+    target_width = IMAGE_WIDTH_INCHES * dpi
+    if width <= target_width and image_format in EMBEDDABLE_IMAGE_FORMATS:
+        # Embedded as it is
+        return file_size
+    scale = min(1.0, target_width / width)
+    pixels = width * height * scale * scale
+    return pixels * (bytes_per_pixel if image_format == 'JPEG' else PNG_BYTES_PER_PIXEL)
 
 
-def get_path_context(file_path, input_dir=None, levels=3):
+def plan_report_budget(tasks, settings, max_bytes):
     """
-    Extract the last N levels of a file path for better context.
-    If input_dir is provided, returns path context relative to input directory.
+    Choose the render settings of each file so that the report fits a size budget.
+    
+    The size of every preview is estimated from the scan at each of the
+    BUDGET_STEPS not better than settings. Starting from settings, the file
+    with the largest estimated preview is moved to its next step, rendering
+    pages as JPEG, until the total fits BUDGET_MARGIN of the budget, so
+    small previews keep their quality and format and nothing is rendered
+    twice. Files left at settings get no settings of their own.
     
     Args:
-        file_path (str): Full file path
-        input_dir (str, optional): Input directory path to make the context relative to
-        levels (int, optional): Number of directory levels to include. Defaults to 3.
+        tasks (list): FileEntry of each file
+        settings (RenderSettings): Render settings the budget starts from
+        max_bytes (int): Size budget of the report
         
     Returns:
-        str: String representing the path context with N levels
+        tuple: (settings of each file whose preview had to be reduced, keyed
+            by file path, estimated report bytes)
     """
-    # If input_dir is provided, try to make the path relative first
-    if input_dir:
-        try:
-            # Normalize paths to handle different path separators
-            norm_file_path = os.path.normpath(file_path)
-            norm_input_dir = os.path.normpath(input_dir)
-            
-            # Check if the file is in the input directory
-            if norm_file_path.startswith(norm_input_dir):
-                # Get the relative path and work with that
-                rel_path = os.path.relpath(norm_file_path, norm_input_dir)
-                path = os.path.dirname(rel_path)
-                
-                # If it's directly in the input directory
-                if path == "":
-                    return "."  # Return dot to indicate it's in the root input directory
-                    
-                # Otherwise process the parts of the relative path
-                parts = path.split(os.sep)
-                if len(parts) <= levels:
-                    return path  # Return the whole relative path if it's shorter than levels
-                else:
-                    return os.path.join(*parts[-levels:])  # Return last N levels of the relative path
-                
-            # If file is not in input directory, fall back to absolute path processing
-        except Exception:
-            pass  # Fall back to absolute path processing
+    steps = [(settings.zoom, settings.image_dpi, settings.jpeg_quality)]
+    # Without JPEG, the first reduction may only change the encoding of pages
+    steps += [step for step in BUDGET_STEPS
+              if step[0] <= settings.zoom and step[1] <= settings.image_dpi and step[2] <= settings.jpeg_quality
+              and (step != steps[0] or settings.image_format != 'jpeg')]
     
-    # Process absolute path (original behavior)
-    parts = []
-    path = os.path.dirname(file_path)
+    sources = {}
+    for entry in tasks:
+        if settings.vector_pdf and entry.kind == 'pdf':
+            # Copied as vector pages, not rendered
+            continue
+        source = measure_preview_source(entry.path, entry.kind)
+        if source is not None:
+            sources[entry.path] = source
     
-    for _ in range(levels):
-        head, tail = os.path.split(path)
-        if tail:
-            parts.insert(0, tail)
-        path = head
-        if not path or path == os.path.sep:
-            break
+    levels = dict.fromkeys(sources, 0)
+    estimates = {file_path: estimate_preview_bytes(source, *steps[0], settings.image_format)
+                 for file_path, source in sources.items()}
+    total = REPORT_BASE_BYTES + REPORT_BYTES_PER_FILE * len(tasks) + sum(estimates.values())
     
-    if parts:
-        return os.path.join(*parts)
-    return os.path.dirname(file_path)
+    # Largest estimated preview first
+    heap = [(-estimate, file_path) for file_path, estimate in estimates.items()]
+    heapq.heapify(heap)
+    while total > max_bytes * BUDGET_MARGIN and heap:
+        _, file_path = heapq.heappop(heap)
+        level = levels[file_path] + 1
+        if level >= len(steps):
+            continue
+        estimate = estimate_preview_bytes(sources[file_path], *steps[level])
+        total += estimate - estimates[file_path]
+        estimates[file_path] = estimate
+        levels[file_path] = level
+        heapq.heappush(heap, (-estimate, file_path))
+    
+    file_settings = {}
+    for file_path, level in levels.items():
+        if not level:
+            continue
+        zoom, dpi, quality = steps[level]
+        file_settings[file_path] = settings.replace(image_format='jpeg', zoom=zoom, image_dpi=dpi,
+                                                    jpeg_quality=quality)
+    return file_settings, total
 
 
-def get_relative_path(file_path, input_dir):
+def format_timings(file_path, timings):
     """
-    Get the path of a file relative to the input directory.
+    Format the processing times of a file for display.
     
     Args:
-        file_path (str): Full path to the file
-        input_dir (str): Input directory path
+        file_path (str): Path to the file
+        timings (dict): Seconds per processing phase, empty for cached previews
         
     Returns:
-        str: Path relative to input directory, or full path if not a subpath
+        str: One line with the total time and the time of each phase
     """
-    try:
-        # Normalize paths to handle different path separators
-        norm_file_path = os.path.normpath(file_path)
-        norm_input_dir = os.path.normpath(input_dir)
-        
-        # Check if the file is in the input directory
-        if norm_file_path.startswith(norm_input_dir):
-            rel_path = os.path.relpath(norm_file_path, norm_input_dir)
-            parent_dir = os.path.dirname(rel_path)
-            return parent_dir if parent_dir else "."  # Return "." if in root input dir
-        else:
-            return os.path.dirname(file_path)  # Fall back to full path if not in input dir
-    except Exception:
-        return os.path.dirname(file_path)  # Fall back in case of error
+    if not timings:
+        return f"  cached {file_path}"
+    phases = ', '.join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items()
+                       if phase != 'total')
+    line = f"{timings.get('total', 0):8.3f}s {file_path}"
+    return f"{line} ({phases})" if phases else line
 
 
-def generate_report(input_dir, output_file):
+def generate_report(input_dir, output_file, jobs=1, settings=None, cache=None, incremental=False,
+                    streaming=False, update_fields=False, timings=False, max_report_size=None,
+                    sniff_types=True, include=None, exclude=None, scan_threads=1, index_sort='walk',
+                    index_group=None):
     """
     Generate a comprehensive report with previews of all files in the input directory.
     
     Args:
         input_dir (str): Input directory containing files to process
         output_file (str): Path to save the generated report
+        jobs (int, optional): Number of worker processes used to build the
+            file previews. Defaults to 1 (process files one at a time).
+        settings (RenderSettings, optional): Render settings for the file
+            previews. Defaults to RenderSettings().
+        cache (PreviewCache, optional): Cache of previews from earlier runs.
+            Defaults to None (render every file).
+        incremental (bool, optional): Only reprocess files added or modified
+            since the run recorded in the manifest beside output_file, reusing
+            the stored previews of all other files. Without a cache, the
+            previews are stored in a '.previews' directory beside the output,
+            which keeps exactly the previews of the latest run. Defaults to
+            False.
+        streaming (bool, optional): Write the .docx incrementally with
+            StreamingDocxWriter instead of building it in memory. Recommended
+            for very large reports. Defaults to False. An output_file ending
+            in '.pdf' is written as a PDF report by PdfReportWriter instead,
+            with the first page of each PDF copied as vector content.
+        update_fields (bool, optional): Open the saved report in Microsoft Word
+            to update its fields, which adds page numbers to the table of
+            contents. The table of contents is generated with working links
+            either way. Defaults to False.
+        timings (bool, optional): Print the time spent on each file and its
+            processing phases. The timings are recorded in the manifest either
+            way. Defaults to False.
+        max_report_size (int, optional): Size budget of the report in bytes.
+            The render resolution and JPEG quality of each file are lowered
+            as needed to fit it, based on an estimate made from the scan.
+            Defaults to None (no budget).
+        sniff_types (bool, optional): Determine file types from their leading
+            bytes rather than their extension alone; files without an
+            extension are included and binary files named as text are
+            skipped. Defaults to True.
+        include (iterable, optional): Glob patterns files must match to be
+            included. Defaults to None (all supported files).
+        exclude (iterable, optional): Glob patterns of files and directories
+            to skip; excluded directories are not descended into. Patterns
+            in .converterignore files apply to their directory's subtree.
+            Defaults to None.
+        scan_threads (int, optional): Number of threads listing directories
+            concurrently, useful on network shares. Defaults to 1.
+        index_sort (str, optional): Order of the File Index entries: 'walk'
+            (order of the report), 'name', 'path' or 'type'. Defaults to
+            'walk'.
+        index_group (str, optional): Group the File Index entries under a
+            heading per directory ('dir') or file type ('type'). Defaults to
+            None (no groups).
         
     Returns:
         None
     """
+    settings = settings or RenderSettings()
+    if jobs > 1:
+        # Every preview worker reads large workbooks with its own sheet
+        # processes, so the cores are shared between them
+        sheet_jobs = max(1, (os.cpu_count() or 1) // jobs)
+        settings = settings.replace(excel_sheet_jobs=min(settings.excel_sheet_jobs or sheet_jobs, sheet_jobs))
+    
     # Convert output_file to absolute path
     output_file_abs = os.path.abspath(output_file)
+    manifest_path = get_manifest_path(output_file_abs)
     
-    doc = Document()
-    doc.add_heading('Document Screenshot Report', 0)
+    own_cache = None
+    if incremental and cache is None:
+        # Not capped by size, which would evict unchanged files in large
+        # trees; pruned to the files of the run instead
+        cache = own_cache = PreviewCache(output_file_abs + '.previews', max_bytes=0)
+    if os.path.splitext(output_file_abs)[1].lower() == '.pdf':
+        # PDF pages stay vector content in a PDF report, which has no Word fields
+        settings = settings.replace(vector_pdf=True)
+        update_fields = False
+        report = PdfReportWriter()
+    elif streaming:
+        report = StreamingDocxWriter(spool_dir=os.path.dirname(output_file_abs))
+    else:
+        report = DocxReportWriter()
+    try:
+        manifest = _generate_report(input_dir, output_file, output_file_abs, manifest_path,
+                                    jobs, settings, cache, incremental, report, update_fields, timings,
+                                    max_report_size, sniff_types, include, exclude, scan_threads,
+                                    index_sort, index_group)
+        if own_cache is not None:
+            own_cache.prune({entry['digest'] for entry in manifest['files'] if entry['digest']})
+    finally:
+        report.close()
+        close_converter_pool()
+        if cache is not None:
+            print(f"Preview cache: {cache.hits} hits, {cache.misses} misses")
+        if own_cache is not None:
+            own_cache.close()
+
+
+def _generate_report(input_dir, output_file, output_file_abs, manifest_path,
+                     jobs, settings, cache, incremental, report, update_fields, timings,
+                     max_report_size, sniff_types, include, exclude, scan_threads, index_sort,
+                     index_group):
+    """
+    Build and save the report; see generate_report for the arguments.
     
-    # Add table of contents heading with improved formatting
-    toc_heading = doc.add_heading('Table of Contents', level=1)
-    toc_heading.style.font.size = Pt(16)
-    toc_heading.style.font.bold = True
+    Returns:
+        dict: Manifest of the run
+    """
     
-    # Create paragraph for TOC field with better formatting
-    paragraph = doc.add_paragraph()
-    run = paragraph.add_run()
+    report.add_heading('Document Screenshot Report', 0)
     
-    # Add TOC field with improved formatting
-    fldChar = OxmlElement('w:fldChar')
-    fldChar.set(qn('w:fldCharType'), 'begin')
+    # Add table of contents heading; the entries are generated on save
+    report.add_heading('Table of Contents', 1)
+    report.add_toc()
     
-    # Enhanced TOC instruction text for better formatting
-    instrText = OxmlElement('w:instrText')
-    instrText.set(qn('xml:space'), 'preserve')
-    instrText.text = 'TOC \\o "1-3" \\h \\z \\u \\w'
+    # Add spacing after TOC
+    report.add_paragraph()
+    report.add_page_break()
     
-    # Add separator
-    fldChar2 = OxmlElement('w:fldChar')
-    fldChar2.set(qn('w:fldCharType'), 'separate')
+    # Only supported extensions, and extensionless files when sniffing, are considered
+    def accept(name):
+        return get_file_kind(name) is not None or (sniff_types and not os.path.splitext(name)[1])
     
-    # Add end field
-    fldChar3 = OxmlElement('w:fldChar')
-    fldChar3.set(qn('w:fldCharType'), 'end')
+    # Collect the supported files in walk order
+    tasks = []
+    # Files are sniffed by the scan threads, right after being listed
+    sniff = FileTypeSniffer().sniff if sniff_types else None
+    for entry in scan_input_dir(input_dir, include or (), exclude or (), accept, scan_threads, sniff):
+        if entry.kind is not None:
+            entry.bookmark = report.bookmarks.register(entry.path, entry.name, entry)
+            tasks.append(entry)
     
-    # Assemble TOC field
-    r_element = run._r
-    r_element.append(fldChar)
-    r_element.append(instrText)
-    r_element.append(fldChar2)
-    r_element.append(fldChar3)
+    # Lower the resolution of the largest previews to fit the size budget
+    file_settings = {}
+    if max_report_size:
+        file_settings, estimate = plan_report_budget(tasks, settings, max_report_size)
+        print(f"Report size budget: {max_report_size / 1024 / 1024:.1f} MB, "
+              f"estimated {estimate / 1024 / 1024:.1f} MB")
     
-    # Add spacing after TOC
-    doc.add_paragraph()
-    doc.add_page_break()
-    
-    # Dictionary to store file paths and their bookmark names
-    file_bookmarks = {}
-    
-    # Process files and create bookmarks
-    for root, _, files in os.walk(input_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            ext = file.lower()
-            bookmark_name = get_valid_bookmark_name(file_path)
-            file_bookmarks[file_path] = bookmark_name
-            
-            # Get path context (last 3 levels of directory)
-            path_context = get_path_context(file_path, input_dir)
-            
-            # Get relative path from input directory
-            rel_location = get_relative_path(file_path, input_dir)
-            
-            if ext.endswith('.pdf'):
-                # Include path context in the heading
-                heading_title = f"{os.path.basename(file_path)} [{path_context}]"
-                heading_para = doc.add_heading(heading_title, level=2)
-                add_bookmark(heading_para, bookmark_name)
-                doc.add_paragraph(f"Location: {rel_location}")
-                process_pdf(file_path, doc)
-            elif ext.endswith(('.doc', '.docx')):
-                heading_title = f"{os.path.basename(file_path)} [{path_context}]"
-                heading_para = doc.add_heading(heading_title, level=2)
-                add_bookmark(heading_para, bookmark_name)
-                doc.add_paragraph(f"Location: {rel_location}")
-                process_word(file_path, doc)
-            elif ext.endswith(('.xls', '.xlsx')):
-                heading_title = f"{os.path.basename(file_path)} [{path_context}]"
-                heading_para = doc.add_heading(heading_title, level=2)
-                add_bookmark(heading_para, bookmark_name)
-                doc.add_paragraph(f"Location: {rel_location}")
-                process_excel(file_path, doc)
-            elif ext.endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                heading_title = f"{os.path.basename(file_path)} [{path_context}]"
-                heading_para = doc.add_heading(heading_title, level=2)
-                add_bookmark(heading_para, bookmark_name)
-                doc.add_paragraph(f"Location: {rel_location}")
-                process_image(file_path, doc)
-            elif ext.endswith(('.txt', '.log', '.md', '.csv')):
-                heading_title = f"{os.path.basename(file_path)} [{path_context}]"
-                heading_para = doc.add_heading(heading_title, level=2)
-                add_bookmark(heading_para, bookmark_name)
-                doc.add_paragraph(f"Location: {rel_location}")
-                process_text(file_path, doc)
+    # Reuse the previews of files unchanged since the previous run
+    known_digests = {}
+    if incremental:
+        previous = load_manifest(manifest_path)
+        if (previous is not None
+                and previous.get('input_dir') == os.path.abspath(input_dir)
+                and previous.get('settings') == settings.cache_key()):
+            previous_files = {entry['path']: entry for entry in previous['files']}
+            added = modified = 0
+            for file_entry in tasks:
+                entry = previous_files.pop(file_entry.path, None)
+                if entry is None:
+                    added += 1
+                elif (entry['size'] != file_entry.size or entry['mtime_ns'] != file_entry.mtime_ns
+                      or not entry['digest']
+                      or entry.get('settings', previous['settings'])
+                      != file_settings.get(file_entry.path, settings).cache_key()):
+                    modified += 1
+                else:
+                    known_digests[file_entry.path] = entry['digest']
+            print(f"Incremental run: {added} added, {modified} modified, "
+                  f"{len(previous_files)} deleted, {len(known_digests)} unchanged")
+        else:
+            print("No usable manifest from a previous run, processing all files.")
     
-    # Add the file entries with internal links to the document
-    doc.add_heading('File Index', level=1)
+    manifest_files = []
     
-    for file_path, bookmark_name in file_bookmarks.items():
-        filename = os.path.basename(file_path)
-        rel_location = get_relative_path(file_path, input_dir)
-        path_context = get_path_context(file_path, input_dir)
+    # Process files and create bookmarks; previews arrive in walk order
+    previews = iter_file_previews(tasks, jobs, settings, cache, known_digests, file_settings)
+    for entry, preview in zip(tasks, previews):
+        file_path = entry.path
+        manifest_files.append({
+            'path': file_path,
+            'size': entry.size,
+            'mtime_ns': entry.mtime_ns,
+            'bookmark': entry.bookmark,
+            'digest': preview.digest,
+            'settings': file_settings.get(file_path, settings).cache_key(),
+            'timings': {phase: round(seconds, 4) for phase, seconds in preview.timings.items()},
+        })
+        if timings:
+            print(format_timings(file_path, preview.timings))
         
-        # Format the entry with file name and path context with internal link
-        entry_para = doc.add_paragraph()
-        add_internal_hyperlink(entry_para, filename, bookmark_name, f"Go to {filename}")
-        entry_para.add_run(f" ({os.path.splitext(filename)[1]}) - {path_context}")
-        
-        # Add the relative directory path on a new line with indentation
-        entry_para.add_run("\n    Location: " + rel_location)
+        # Include path context (last 3 levels of directory) in the heading
+        heading_title = f"{entry.name} [{entry.context}]"
+        report.add_heading(heading_title, 2, entry.bookmark)
+        report.add_paragraph(f"Location: {entry.rel_dir}")
+        try:
+            preview.write_to(report, entry.bookmark)
+        except Exception as e:
+            # A preview the report cannot hold only costs this file's section
+            print(f"Error processing {file_path}: {str(e)}")
+            report.add_paragraph(f"Error processing {file_path}: {str(e)}")
+    
+    # Add the file entries with internal links to the document
+    report.add_heading('File Index', 1, 'bm_file_index')
+    
+    for title, targets in group_index_entries(report.bookmarks.targets(), index_sort, index_group):
+        if title is not None:
+            report.add_heading(title, 2)
+        report.add_index_entries((entry.name, bookmark_name, entry.context, entry.rel_dir)
+                                 for bookmark_name, entry in targets)
+    
+    manifest = {
+        'version': PreviewCache.VERSION,
+        'input_dir': os.path.abspath(input_dir),
+        'settings': settings.cache_key(),
+        'files': manifest_files,
+    }
     
     try:
-        doc.save(output_file_abs)
+        report.save(output_file_abs)
         print(f"Report generated at: {output_file}")
+        if max_report_size:
+            report_size = os.path.getsize(output_file_abs)
+            print(f"Report size: {report_size / 1024 / 1024:.1f} MB")
+            if report_size > max_report_size:
+                print("Warning: the report exceeds the size budget; lower --image-dpi or --jpeg-quality.")
+        write_manifest(manifest_path, manifest)
         
-        # Update TOC using Word COM interface
-        pythoncom.CoInitialize()
-        
-        word = win32com.client.DispatchEx("Word.Application")
-        word.Visible = False
-        
-        # Use absolute path when opening with Word
-        word_doc = word.Documents.Open(output_file_abs)
-        word_doc.Fields.Update()
-        word_doc.Save()
-        word_doc.Close()
-        
-        # Release the Word application instead of quitting
-        word = None
-        pythoncom.CoUninitialize()
+        if update_fields:
+            update_fields_with_word(output_file_abs)
     except PermissionError:
         alt_output = os.path.join(os.getcwd(), f"report_{os.path.basename(output_file)}")
         alt_output_abs = os.path.abspath(alt_output)
         try:
-            doc.save(alt_output_abs)
+            report.save(alt_output_abs)
             print(f"Could not save to {output_file} due to permission denied.")
             print(f"Report saved to alternative location: {alt_output}")
             
-            # Update TOC using Word COM interface
-            pythoncom.CoInitialize()
-            
-            word = win32com.client.DispatchEx("Word.Application")
-            word.Visible = False
-            word_doc = word.Documents.Open(alt_output_abs)
-            word_doc.Fields.Update()
-            word_doc.Save()
-            word_doc.Close()
-            
-            # Release the Word application instead of quitting
-            word = None
-            pythoncom.CoUninitialize()
+            if update_fields:
+                update_fields_with_word(alt_output_abs)
         except Exception as e:
             print(f"Failed to save report to both original and alternative locations.")
             print(f"Please ensure you have write permissions or try a different output location.")
@@ -692,6 +4917,7 @@ def generate_report(input_dir, output_file):
     except Exception as e:
         print(f"Error saving report: {str(e)}")
         raise
+    return manifest
 
 
 if __name__ == "__main__":
@@ -706,7 +4932,75 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--input", required=True, 
                       help="Input directory (use quotes for paths with spaces)")
     parser.add_argument("-o", "--output", default="report.docx", 
-                      help="Output file name")
+                      help="Output file name; a .pdf name writes a PDF report")
+    parser.add_argument("--include", action="append", default=[], metavar="PATTERN",
+                      help="Only include files matching this glob pattern (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                      help="Skip files and directories matching this glob pattern, e.g. '*/node_modules/*' "
+                           "(repeatable)")
+    parser.add_argument("--scan-threads", type=int, default=8,
+                      help="Number of threads listing directories concurrently")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                      help="Number of worker processes used to build file previews "
+                           "(0 uses all CPU cores)")
+    parser.add_argument("--image-format", choices=["png", "jpeg"], default="png",
+                      help="Image format used for rendered document pages")
+    parser.add_argument("--jpeg-quality", type=int, default=85,
+                      help="JPEG quality (1-100) when --image-format is jpeg")
+    parser.add_argument("--max-report-size", type=float,
+                      help="Size budget of the report in MB; the resolution and JPEG quality of the "
+                           "largest previews are lowered to fit it")
+    parser.add_argument("--converter", choices=["auto"] + list(CONVERTER_BACKENDS) + ["none"],
+                      default="auto",
+                      help="Backend converting Word and Excel files to PDF "
+                           "('none' extracts their content directly)")
+    parser.add_argument("--converter-recycle", type=int, default=50,
+                      help="Restart a converter instance after this many documents (0 never restarts)")
+    parser.add_argument("--image-dpi", type=int, default=150,
+                      help="Resolution images are downscaled to at their 6 inch display width")
+    parser.add_argument("--word-pages", type=int, default=1,
+                      help="Leading pages of Word documents exported to PDF for the preview "
+                           "(0 exports the whole document)")
+    parser.add_argument("--excel-pages", type=int, default=1,
+                      help="Leading printed pages of Excel workbooks exported to PDF for the preview "
+                           "(0 exports the whole workbook)")
+    parser.add_argument("--tail-extensions", nargs="*", default=[".log"], metavar="EXT",
+                      help="Extensions of text files previewed from their last lines "
+                           "(pass the option alone to disable)")
+    parser.add_argument("--csv-profile", action="store_true",
+                      help="Add row counts and column statistics to CSV previews")
+    parser.add_argument("--csv-profile-rows", type=int, default=1000000,
+                      help="Data rows the CSV column statistics are computed over (0 for all)")
+    parser.add_argument("--excel-sheets", type=int, default=1,
+                      help="Worksheets previewed per workbook, each under its own subheading "
+                           "(0 for all; 1 previews the active sheet)")
+    parser.add_argument("--excel-sheet-jobs", type=int, default=0,
+                      help="Worker processes reading the sheets of a large workbook concurrently "
+                           "(0 uses all CPU cores)")
+    parser.add_argument("--no-thumbnails", action="store_true",
+                      help="Convert Word and Excel files even when they embed a thumbnail")
+    parser.add_argument("--no-sniff", action="store_true",
+                      help="Determine file types from their extension only, without reading their first bytes")
+    parser.add_argument("--index-sort", choices=sorted(INDEX_SORT_KEYS), default="walk",
+                      help="Order of the File Index entries")
+    parser.add_argument("--index-group", choices=["dir", "type"],
+                      help="Group the File Index entries by directory or file type")
+    parser.add_argument("--timings", action="store_true",
+                      help="Print the time spent on each file and its processing phases")
+    parser.add_argument("--cache-dir",
+                      help="Directory for a persistent preview cache reused across runs")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                      help="Maximum size of the preview cache in MB")
+    parser.add_argument("--cache-hash", action="store_true",
+                      help="Key cached previews by file content hash instead of modification time")
+    parser.add_argument("--streaming", action="store_true",
+                      help="Write the report incrementally to keep memory use bounded on very large trees")
+    parser.add_argument("--update-fields", action="store_true",
+                      help="Update the report's fields in Microsoft Word after saving "
+                           "(adds page numbers to the table of contents)")
+    parser.add_argument("--incremental", action="store_true",
+                      help="Only reprocess files added or modified since the previous run "
+                           "recorded in the manifest beside the output")
     
     args = parser.parse_args()
     
@@ -715,7 +5009,30 @@ if __name__ == "__main__":
         print(f"Error: Input directory '{args.input}' does not exist.")
         exit(1)
     
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    
     # Generate the report
     print(f"Processing files in '{args.input}'...")
-    generate_report(args.input, args.output)
+    settings = RenderSettings(image_format=args.image_format, jpeg_quality=args.jpeg_quality,
+                              converter=args.converter, converter_recycle=args.converter_recycle,
+                              word_pages=args.word_pages, excel_pages=args.excel_pages,
+                              tail_extensions=args.tail_extensions, csv_profile=args.csv_profile,
+                              csv_profile_rows=args.csv_profile_rows, excel_sheets=args.excel_sheets,
+                              excel_sheet_jobs=args.excel_sheet_jobs,
+                              use_thumbnails=not args.no_thumbnails, image_dpi=args.image_dpi)
+    cache = None
+    if args.cache_dir:
+        cache = PreviewCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024,
+                             hash_content=args.cache_hash)
+    try:
+        generate_report(args.input, args.output, jobs=jobs, settings=settings, cache=cache,
+                        incremental=args.incremental, streaming=args.streaming,
+                        update_fields=args.update_fields, timings=args.timings,
+                        max_report_size=int(args.max_report_size * 1024 * 1024) if args.max_report_size else None,
+                        sniff_types=not args.no_sniff, include=args.include, exclude=args.exclude,
+                        scan_threads=args.scan_threads, index_sort=args.index_sort,
+                        index_group=args.index_group)
+    finally:
+        if cache is not None:
+            cache.close()
     print(f"Report generation complete. Output saved to: {os.path.abspath(args.output)}")
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Tests for ConverterPool, run against the in-process FakeBackend.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_converter import ConverterCrashed, ConverterPool, FakeBackend
+
+
+def convert_documents(pool, tmp_path, count):
+    """Convert count fake documents on the pool, returning the written PDFs."""
+    pdf_paths = []
+    for number in range(count):
+        pdf_path = str(tmp_path / f"document{number}.pdf")
+        pool.convert(str(tmp_path / f"document{number}.docx"), pdf_path, 'word')
+        pdf_paths.append(pdf_path)
+    return pdf_paths
+
+
+def test_crashed_instances_are_replaced_and_retried(tmp_path):
+    pool = ConverterPool(lambda: FakeBackend(crash_after=2), max_documents=0)
+    pdf_paths = convert_documents(pool, tmp_path, 7)
+    pool.close()
+
+    # Every third document crashes its instance and is retried on a new one
+    assert all(os.path.exists(pdf_path) for pdf_path in pdf_paths)
+    assert pool.crashed == 3
+    assert pool.started == 4
+    assert pool.recycled == 0
+
+
+def test_instances_are_recycled_after_max_documents(tmp_path):
+    pool = ConverterPool(FakeBackend, max_documents=3)
+    convert_documents(pool, tmp_path, 7)
+    pool.close()
+
+    assert pool.recycled == 2
+    assert pool.started == 3
+    assert pool.crashed == 0
+
+
+def test_document_is_retried_only_once(tmp_path):
+    pool = ConverterPool(lambda: FakeBackend(crash_after=0))
+    with pytest.raises(ConverterCrashed):
+        convert_documents(pool, tmp_path, 1)
+    pool.close()
+
+    assert pool.crashed == 2
+    assert pool.started == 2
@@ -0,0 +1,42 @@
+"""
+Tests for building file previews in worker processes.
+"""
+
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document_converter
+from document_converter import RenderSettings, iter_file_previews, scan_input_dir
+
+
+def crash_on_marked_files(file_path, preview, settings):
+    """Text processor whose worker dies on files named crash*."""
+    if os.path.basename(file_path).startswith('crash'):
+        os._exit(1)
+    preview.add_paragraph(os.path.basename(file_path))
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="workers only see the patched processor when forked")
+def test_worker_crash_only_fails_its_file(tmp_path, monkeypatch):
+    monkeypatch.setitem(document_converter.FILE_PROCESSORS, 'text', crash_on_marked_files)
+    names = [f"file{number:02d}.txt" for number in range(12)]
+    names.insert(5, 'crash.txt')
+    for name in names:
+        (tmp_path / name).write_text(name)
+    tasks = sorted(scan_input_dir(str(tmp_path)), key=lambda entry: entry.name)
+
+    previews = list(iter_file_previews(tasks, jobs=3, settings=RenderSettings(converter='none')))
+
+    assert len(previews) == len(tasks)
+    for entry, preview in zip(tasks, previews):
+        if entry.name == 'crash.txt':
+            assert preview.failed
+        else:
+            assert not preview.failed
+            assert preview.blocks == [('paragraph', entry.name)]